@@ -58,44 +58,51 @@ def get_data():
     return data
 
 
-from joblib import Parallel, delayed
-from datetime import date, datetime, timedelta, timezone, time
+from joblib import Parallel
+from datetime import date, datetime, timedelta, time
 from multiprocessing import cpu_count
 from zipfile import ZipFile
 from genericpath import isfile
+from functools import partial
+from pyarrow.dataset import dataset, field
 # Downloads Daily Regional Forecast and Actual Load (xls)
 
 # The MISO website keeps older data in a different location than more recent data
-market_timezone = timezone(timedelta(hours=-5))
-def prevailing_time(yyyy, mm, dd, hh):
-    return datetime(yyyy, mm, dd, hh, tzinfo=market_timezone)
+from market_time import market_timezone, prevailing_time, market_hours
 
 archive_cutoff = datetime(date.today().year - 3, 12, 31, tzinfo=market_timezone)
 
 parallel = Parallel(n_jobs=cpu_count())
 
+import fetch
+import instrument
 import util
 
 class MarketReports(util.WebClient):
     def __init__(self, output_dir) -> None:
-        Path(output_dir).mkdir(exist_ok=True)
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
         self.output_dir = output_dir
 
+    @staticmethod
+    def __url(file_name):
+        return f'https://docs.misoenergy.org/marketreports/{file_name}'
+
     def download(self, file_name):
         output_path = f'{self.output_dir}/{file_name}'
         if not isfile(output_path):
-            url = f'https://docs.misoenergy.org/marketreports/{file_name}'
-            response = self.get(url)
+            response = self.get(MarketReports.__url(file_name))
             with open(output_path, 'wb') as f:
                 f.write(response.content)
         return output_path
 
+    def download_all(self, file_names):
+        """Concurrent download for many reports, see fetch.download_all"""
+        return fetch.download_all((MarketReports.__url(f), f'{self.output_dir}/{f}') for f in file_names)
+
     def __get_archive(self, start_date, end_date, suffix):
         month_starts = pd.date_range(start_date, end_date, freq='MS')
-        for ms in month_starts:
-            YYYYMM = ms.strftime('%Y%m')
-            filename = f'{YYYYMM}_{suffix}_xls.zip'
-            zipfile = self.download(filename)
+        filenames = [f'{ms.strftime("%Y%m")}_{suffix}_xls.zip' for ms in month_starts]
+        for zipfile in self.download_all(filenames):
             with ZipFile(zipfile, 'r') as zip_ref:
                 zip_ref.extractall(self.output_dir)
 
@@ -106,7 +113,9 @@ class MarketReports(util.WebClient):
 
     @staticmethod
     def __load_data(p, cols, header_rows):
-        df = pd.read_excel(p, skiprows=header_rows) 
+        with instrument.span('miso.read_excel', path=str(p)):
+            df = pd.read_excel(p, skiprows=header_rows) 
+        instrument.count('rows_parsed', df.shape[0])
         df = df[1:25]
         common_cols = ['HourEnding', 'MISO MTLF (MWh)', 'MISO ActualLoad (MWh)']
         #HACK
@@ -122,28 +131,46 @@ class MarketReports(util.WebClient):
         return df
 
 
+    @staticmethod
+    def __ingest(path, part, cols, header_rows):
+        df = MarketReports.__load_data(path, cols, header_rows)
+        # the staging file is ignored by the dataset reader until renamed
+        util.atomic_write(part, partial(df.to_parquet, index=False))
+
+    def __load_store(self, market_days, cols, suffix, header_rows):
+        """Parses each market day's report once into an append-only store of
+        one parquet file per day, then reads the requested days back with a
+        filter on Market Day."""
+        store = f'{self.output_dir}/{suffix}_store'
+        Path(store).mkdir(exist_ok=True)
+        parts = {day: f'{store}/{day.strftime("%Y%m%d")}.parquet' for day in market_days}
+        missing = [day for day in market_days if not isfile(parts[day])]
+        _ = instrument.gather(parallel(
+            instrument.delayed(MarketReports.__ingest)(f'{self.output_dir}/{MarketReports.__file_name(day, suffix)}',
+                                                       parts[day], cols, header_rows) for day in missing))
+
+        first = datetime.combine(market_days[0].date(), time())
+        last = datetime.combine(market_days[-1].date(), time())
+        table = dataset(store, format='parquet').to_table(
+            filter=(field('Market Day') >= first) & (field('Market Day') <= last))
+        return table.to_pandas().sort_values(['Market Day', 'HourEnding'], kind='stable')
+
     def __hourly_load(self, start_date, desired_end_date, cols, suffix, header_rows):
         # the actuals aren't available until the next day
         # so we need to shift begin and end
         end_date = desired_end_date + timedelta(days=2.0) 
         num_days = range(1, (end_date - start_date).days)
-        paths = [f'{self.output_dir}/{MarketReports.__file_name(start_date + timedelta(days = d), suffix)}' for d in num_days]
+        market_days = [start_date + timedelta(days = d) for d in num_days]
 
         if start_date < archive_cutoff:
             archive_end = end_date if end_date <= archive_cutoff else archive_cutoff
             self.__get_archive(start_date, archive_end, suffix)
 
-        begin = start_date if start_date > archive_cutoff else archive_cutoff + timedelta(days=1)
-        all_days = pd.date_range(begin, end_date)
-        _ = parallel(delayed(self.download)(MarketReports.__file_name(day, suffix)) for day in all_days)
-
-        dfs = [MarketReports.__load_data(p, cols, header_rows) for p in paths]
+        # only the reports parsed below; later ones are usually not published yet
+        _ = self.download_all(MarketReports.__file_name(day, suffix) for day in market_days if day > archive_cutoff)
 
-        actuals = pd.concat(dfs)
-        def mktime_idx(row): 
-            dt = row['Market Day'].date()
-            return prevailing_time(dt.year, dt.month, dt.day, row['HourEnding'] - 1)
-        actuals['market_hour'] = actuals.apply(mktime_idx, axis = 1)
+        actuals = self.__load_store(market_days, cols, suffix, header_rows)
+        actuals['market_hour'] = market_hours(actuals['Market Day'], actuals['HourEnding'])
         return actuals.set_index('market_hour')
 
     def regional_hourly_load(self, start_date, end_date):
@@ -0,0 +1,272 @@
+"""Benchmarks for the data and validation hot paths, on synthetic fixtures
+(generated MISO xls reports, ASOS csv downloads and years of hourly zone
+data), so no network is needed.
+
+Each benchmark reports the best wall time over --repeat runs, the rows it
+handles per second and the peak memory traced during one more run. Save the
+results as a baseline and compare a later commit against it:
+
+    python benchmarks.py --save baseline.json
+    python benchmarks.py --compare baseline.json
+
+--trace writes the spans and counters of the runs (see instrument) as a
+Chrome trace.
+
+Writing the xls fixtures requires xlwt (a dev package).
+"""
+from argparse import ArgumentParser
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from shutil import rmtree
+from subprocess import run as run_process
+from tempfile import mkdtemp
+from time import perf_counter
+import json
+import platform
+import sys
+import tracemalloc
+import numpy as np
+import pandas as pd
+from pytz import utc
+from datasets import Zone1, prior_load_colname
+import instrument
+from market_time import prevailing_time
+import validation
+import MISO
+import weather_data
+
+zonal_columns = ['LRZ1 MTLF (MWh)', 'LRZ1 ActualLoad (MWh)', 'LRZ2_7 MTLF (MWh)',
+                 'LRZ2_7 ActualLoad (MWh)', 'LRZ3_5 MTLF (MWh)', 'LRZ3_5 ActualLoad (MWh)',
+                 'LRZ4 MTLF (MWh)', 'LRZ4 ActualLoad (MWh)', 'LRZ6 MTLF (MWh)',
+                 'LRZ6 ActualLoad (MWh)', 'LRZ8_9_10 MTLF (MWh)', 'LRZ8_9_10 ActualLoad (MWh)']
+
+def write_zonal_reports(folder, first_day, days, seed=0):
+    """Daily df_al reports in the layout MarketReports.zonal_hourly_load reads"""
+    import xlwt
+    rng = np.random.default_rng(seed)
+    header = ['Market Day', 'HourEnding', 'MISO MTLF (MWh)', 'MISO ActualLoad (MWh)'] + zonal_columns
+    header_rows = 4
+    for d in range(days):
+        day = first_day + timedelta(days=d)
+        book = xlwt.Workbook()
+        sheet = book.add_sheet('Sheet1')
+        for r in range(header_rows):
+            sheet.write(r, 0, f'Daily Forecast and Actual Load by Local Resource Zone {r}')
+        for (c, name) in enumerate(header):
+            sheet.write(header_rows, c, name)
+            sheet.write(header_rows + 1, c, '')
+        loads = rng.uniform(5000, 90000, (24, len(header) - 2)).round(2)
+        for h in range(24):
+            sheet.write(header_rows + 2 + h, 0, day.strftime('%m/%d/%Y'))
+            sheet.write(header_rows + 2 + h, 1, h + 1)
+            for (c, load) in enumerate(loads[h], 2):
+                sheet.write(header_rows + 2 + h, c, float(load))
+        book.save(f'{folder}/{day.strftime("%Y%m%d")}_df_al.xls')
+
+def asos_csv(id, start_utc, end_utc, seed=0):
+    """What the IEM ASOS download returns: 5-minute observations with
+    missing readings, 'M' values and the odd duplicate"""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start_utc.date(), end_utc.date() + timedelta(days=2), freq='5min', tz=utc)
+    times = times[rng.random(len(times)) > 0.3]
+    hours = (times - times[0]).total_seconds().to_numpy() / 3600
+    temps = (40 + 30*np.sin(2*np.pi*hours/(24*365)) + 10*np.sin(2*np.pi*hours/24)
+             + rng.normal(0, 1, len(times))).round(1).astype(str).astype(object)
+    temps[rng.random(len(times)) < 0.02] = 'M'
+    df = pd.DataFrame({'station': id, 'valid': times.strftime('%Y-%m-%d %H:%M'),
+                       'lon': -93.2, 'lat': 44.9, 'tmpf': temps, 'feel': temps})
+    df = pd.concat([df, df.sample(frac=0.01, random_state=seed)]).sort_values('valid', kind='stable')
+    header = ''.join(f'#DEBUG: {line}\n' for line in ['Format Typ -> comma', 'Time Period -> synthetic',
+                                                      'Time Zone -> Etc/UTC', 'Data Contact -> none',
+                                                      'Entries -> synthetic'])
+    return header + df.to_csv(index=False)
+
+def zone_frame(years, seed=0):
+    """Hourly data in the layout of data/zone1_prior_load.parquet"""
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range(prevailing_time(2015, 1, 1, 0), periods=int(years*365)*24, freq='h')
+    t = np.arange(len(hours))
+    load = (10000 + 1500*np.sin(2*np.pi*t/24) + 800*np.sin(2*np.pi*t/(24*365))
+            + rng.normal(0, 100, len(hours)))
+    df = pd.DataFrame(index=hours)
+    df['MSP'] = 40 + 30*np.sin(2*np.pi*t/(24*365)) + rng.normal(0, 3, len(hours))
+    df['DayOfYear'] = hours.day_of_year
+    df['HourEnding'] = hours.hour + 1
+    df['IsBusinessHour'] = ((hours.dayofweek < 5) & (hours.hour >= 9) & (hours.hour <= 17)).astype(int)
+    lags = np.lib.stride_tricks.sliding_window_view(np.r_[np.full(32, np.nan), load], 32)[:len(load)]
+    for (i, lag) in zip(range(32, 0, -1), lags.T):
+        df[prior_load_colname(i)] = lag
+    df['LRZ1 ActualLoad (MWh)'] = load
+    df['LRZ1 MTLF (MWh)'] = load + rng.normal(0, 150, len(hours))
+    return df.iloc[32:]
+
+# Each benchmark takes a scratch folder and a size scale, and returns the rows
+# it handles, a prepare step run untimed before every run, and the run itself.
+
+def market_reports(folder, scale):
+    days = max(2, int(60*scale))
+    first = date(datetime.now().year, 1, 1) - timedelta(days=days + 7)
+    write_zonal_reports(folder, first, days + 4)
+    start = prevailing_time(first.year, first.month, first.day, 0) + timedelta(days=1)
+    end = start + timedelta(days=days - 1, hours=23)
+    def prepare():
+        rmtree(f'{folder}/df_al_store', ignore_errors=True)
+    def run():
+        MISO.MarketReports(folder).zonal_hourly_load(start, end)
+    return (days*24, prepare, run)
+
+def market_reports_warm(folder, scale):
+    (rows, _, run) = market_reports(folder, scale)
+    run()
+    return (rows, None, run)
+
+def asos_hourly(folder, scale):
+    stations = ['MSP', 'RST', 'DLH', 'FAR']
+    start = prevailing_time(2019, 1, 1, 0)
+    end = start + timedelta(days=max(2, int(365*scale))) - timedelta(hours=1)
+    start_utc = start.astimezone(utc) - timedelta(days=7)
+    end_utc = end.astimezone(utc) + timedelta(days=7)
+    for (i, id) in enumerate(stations):
+        # named as get_many_hourly_observations names its downloads, so none are made
+        with open(f'{folder}/{id}_{start_utc:%Y%m%d}_{end_utc:%Y%m%d}.csv', 'w') as f:
+            f.write(asos_csv(id, start_utc, end_utc, seed=i))
+    asos = weather_data.ASOS()
+    def run():
+        asos.get_many_hourly_observations(stations, start, end, folder)
+    return (len(stations)*int((end - start).total_seconds() // 3600 + 1), None, run)
+
+def dataset_init(folder, scale):
+    df = zone_frame(max(3, 7*scale))
+    df.to_parquet(f'{folder}/zone1.parquet')
+    def prepare():
+        Path(f'{folder}/zone1.arrow').unlink(missing_ok=True)
+    def run():
+        ds = Zone1(f'{folder}/zone1.parquet')
+        _ = ds.train_data, ds.validation_data, ds.test_data
+    return (df.shape[0], prepare, run)
+
+def dataset_warm(folder, scale):
+    (rows, prepare, run) = dataset_init(folder, scale)
+    prepare()
+    run()
+    return (rows, None, run)
+
+def hourly_prediction(folder, scale):
+    from sklearn.linear_model import LinearRegression
+    df = zone_frame(3)
+    features = ([prior_load_colname(i) for i in Zone1.correlated_prior_hours]
+                + ['DayOfYear', 'IsBusinessHour', 'HourEnding'])
+    model = LinearRegression().fit(df[features], df['LRZ1 ActualLoad (MWh)'])
+    days = max(1, int(365*scale))
+    days_X = [df.iloc[24*d:24*(d + 1)] for d in range(days)]
+    def run():
+        for X in days_X:
+            validation.hourly_prediction(model, X, Zone1.next_hour, features)
+    return (days*24, None, run)
+
+def walkforward(folder, scale):
+    from sklearn.linear_model import LinearRegression
+    df = zone_frame(3)
+    features = ([prior_load_colname(i) for i in Zone1.correlated_prior_hours]
+                + ['DayOfYear', 'IsBusinessHour', 'HourEnding'])
+    days = max(1, int(60*scale))
+    start = df.index[-24*days]
+    def run():
+        validation.walkforward(LinearRegression(), df, df['LRZ1 ActualLoad (MWh)'], start, df.index[-1],
+                               Zone1.next_hour, features)
+    return (days*24, None, run)
+
+benchmarks = {'market_reports': market_reports,
+              'market_reports_warm': market_reports_warm,
+              'asos_hourly': asos_hourly,
+              'dataset_init': dataset_init,
+              'dataset_warm': dataset_warm,
+              'hourly_prediction': hourly_prediction,
+              'walkforward': walkforward}
+
+def measure(benchmark, scale, repeat):
+    folder = mkdtemp(prefix='benchmark_')
+    try:
+        (rows, prepare, run) = benchmark(folder, scale)
+        times = []
+        for _ in range(repeat):
+            if prepare:
+                prepare()
+            started = perf_counter()
+            run()
+            times.append(perf_counter() - started)
+        # traced separately, tracemalloc slows the run down
+        if prepare:
+            prepare()
+        tracemalloc.start()
+        run()
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        rmtree(folder, ignore_errors=True)
+    seconds = min(times)
+    return {'seconds': seconds, 'rows': rows, 'rows_per_second': rows / seconds,
+            'peak_mb': peak / 2**20}
+
+def environment():
+    commit = run_process(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    return {'commit': commit.stdout.strip() or None,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine()}
+
+def compare(results, baseline, threshold):
+    """Prints the change against the baseline and returns the regressions"""
+    regressions = []
+    print(f'{"benchmark":<22}{"baseline s":>12}{"now s":>10}{"ratio":>8}{"peak MB":>10}{"now MB":>9}')
+    for (name, now) in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f'{name:<22}{"-":>12}{now["seconds"]:>10.3f}')
+            continue
+        ratio = now['seconds'] / before['seconds']
+        flag = '  slower' if ratio > threshold else ('  faster' if ratio < 1 / threshold else '')
+        print(f'{name:<22}{before["seconds"]:>12.3f}{now["seconds"]:>10.3f}{ratio:>8.2f}'
+              f'{before["peak_mb"]:>10.1f}{now["peak_mb"]:>9.1f}{flag}')
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the data and validation hot paths')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run, of {", ".join(benchmarks)} (default all)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the fixture sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='a JSON file saved earlier to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='time ratio over the baseline counted as a regression')
+    parser.add_argument('--trace', help='record spans and counters and write them to this JSON file')
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in benchmarks]
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+
+    if args.trace:
+        instrument.enable()
+    results = {}
+    for name in args.names or benchmarks:
+        results[name] = measure(benchmarks[name], args.scale, args.repeat)
+        r = results[name]
+        print(f'{name:<22}{r["seconds"]:>10.3f} s{r["rows_per_second"]:>14,.0f} rows/s'
+              f'{r["peak_mb"]:>10.1f} MB peak', flush=True)
+
+    if args.trace:
+        instrument.write(args.trace)
+    report = {'environment': environment(), 'scale': args.scale, 'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale:
+            print(f'baseline was run at scale {baseline.get("scale")}, not {args.scale}')
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
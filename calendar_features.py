@@ -0,0 +1,108 @@
+"""Calendar features for an hourly DatetimeIndex, computed in bulk with array
+math against precomputed holiday and daylight saving tables.
+
+    df = df.join(calendar_features(df.index))
+"""
+from functools import cache
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import USFederalHolidayCalendar
+
+day = 24*60*60
+year = (365.2425)*day
+
+# the market runs on EST year round, but most of the load follows central civil time
+civil_timezone = 'US/Central'
+
+@cache
+def holiday_table(first_year = 1970, last_year = 2100):
+    """Federal holidays as sorted day numbers (datetime64[D] as int64)"""
+    holidays = USFederalHolidayCalendar().holidays(f'{first_year}-01-01', f'{last_year}-12-31')
+    return holidays.to_numpy().astype('datetime64[D]').astype(np.int64)
+
+@cache
+def dst_table(tz = civil_timezone, first_year = 1970, last_year = 2100):
+    """The UTC instants (int64 ns) at which tz's offset changes, and whether
+    daylight time is in effect from each of them on"""
+    hours = pd.date_range(f'{first_year}-01-01', f'{last_year + 1}-01-01', freq='h', tz='UTC')
+    offsets = hours.tz_convert(tz).tz_localize(None).asi8 - hours.asi8
+    changes = np.flatnonzero(offsets[1:] != offsets[:-1]) + 1
+    return (hours.asi8[changes], offsets[changes] > offsets[changes - 1])
+
+def _wall_days(hours: pd.DatetimeIndex):
+    """Day numbers and hour of day of the local wall time"""
+    # the arithmetic below is in nanoseconds, whatever the index's unit
+    hours = hours.as_unit('ns')
+    wall = hours.tz_localize(None).asi8 if hours.tz else hours.asi8
+    days = wall // (day * 10**9)
+    return (days, (wall - days * day * 10**9) // (3600 * 10**9))
+
+def _isin(values, table):
+    positions = np.searchsorted(table, values).clip(max=len(table) - 1)
+    return table[positions] == values
+
+def _days_off(days):
+    # 1970-01-01 was a Thursday
+    weekend = (days + 3) % 7 >= 5
+    return (weekend, _isin(days, holiday_table()))
+
+def is_business_hour(hours: pd.DatetimeIndex):
+    """1 for hours from 9:00 through 17:00 of weekdays that are not federal
+    holidays, else 0; the same as checking each hour with
+    CustomBusinessDay(calendar=USFederalHolidayCalendar()).is_on_offset and
+    BusinessHour().is_on_offset"""
+    (days, hour) = _wall_days(hours)
+    (weekend, holiday) = _days_off(days)
+    return (~weekend & ~holiday & (hour >= 9) & (hour <= 17)).astype(int)
+
+def is_bridge_day(hours: pd.DatetimeIndex):
+    """1 for hours of a working day between a holiday and a weekend (or
+    another holiday), e.g. the Friday after Thanksgiving, else 0"""
+    (days, _) = _wall_days(hours)
+    (weekend, holiday) = _days_off(days)
+    (weekend_before, holiday_before) = _days_off(days - 1)
+    (weekend_after, holiday_after) = _days_off(days + 1)
+    return (~weekend & ~holiday
+            & (weekend_before | holiday_before) & (weekend_after | holiday_after)
+            & (holiday_before | holiday_after)).astype(int)
+
+def daylight_time(hours: pd.DatetimeIndex, tz = civil_timezone):
+    """(IsDaylightTime, IsDSTTransition): whether tz is on daylight time at
+    each hour, and whether the hour falls on a tz calendar day that the
+    clocks change"""
+    (changes, to_daylight) = dst_table(tz)
+    # like pd.Timestamp.timestamp, a naive index is taken to be UTC
+    local = (hours if hours.tz else hours.tz_localize('UTC')).tz_convert(tz).as_unit('ns')
+    latest = np.searchsorted(changes, local.asi8, side='right') - 1
+    is_daylight = np.where(latest >= 0, to_daylight[latest.clip(min=0)], False)
+
+    change_days = np.unique(pd.DatetimeIndex(changes).tz_localize('UTC').tz_convert(tz)
+                            .tz_localize(None).asi8 // (day * 10**9))
+    (days, _) = _wall_days(local)
+    return (is_daylight.astype(int), _isin(days, change_days).astype(int))
+
+def fourier_features(hours: pd.DatetimeIndex):
+    """Daily, weekly and yearly sin/cos of the POSIX timestamp, as computed
+    from hours.to_series().map(pd.Timestamp.timestamp)"""
+    ns = hours.as_unit('ns').asi8
+    timestamp_s = (ns // 10**9) + (ns % 10**9) / 10**9
+    df = pd.DataFrame(index=hours)
+    for (name, period) in [('Daily', day), ('Weekly', 7*day), ('Yearly', year)]:
+        df[f'{name} sin'] = np.sin(timestamp_s * (2 * np.pi / period))
+        df[f'{name} cos'] = np.cos(timestamp_s * (2 * np.pi / period))
+    return df
+
+def calendar_features(hours: pd.DatetimeIndex, tz = civil_timezone):
+    """All of the calendar features for an hourly index, one column each"""
+    (days, _) = _wall_days(hours)
+    (_, holiday) = _days_off(days)
+    (is_daylight, is_transition) = daylight_time(hours, tz)
+    df = pd.DataFrame(index=hours)
+    df['DayOfYear'] = hours.day_of_year
+    df['DayOfWeek'] = hours.day_of_week
+    df['IsBusinessHour'] = is_business_hour(hours)
+    df['IsHoliday'] = holiday.astype(int)
+    df['IsBridgeDay'] = is_bridge_day(hours)
+    df['IsDaylightTime'] = is_daylight
+    df['IsDSTTransition'] = is_transition
+    return df.join(fourier_features(hours))
@@ -1,8 +1,132 @@
 
-from dataclasses import InitVar, dataclass
+from dataclasses import dataclass
 from datetime import timedelta, datetime
-from functools import cached_property
+from functools import cached_property, partial
+from genericpath import isfile
+from os.path import getmtime
+from pathlib import Path
+import json
+import numpy as np
 import pandas as pd
+from pyarrow import feather
+import pyarrow.parquet as pq
+from util import atomic_write
+
+def prior_load_colname(i):
+    return f"Actual Load {i} hours prior"
+
+@dataclass(frozen=True)
+class LagRecursion():
+    """Describes how the lagged load features of an hour follow from the hour
+    before it: the prediction becomes `predicted` and each (column, prior)
+    pair takes the prior hour's value of `prior`. Calling it is the pandas
+    `next_hour` step; `validation.recursive_prediction` runs it on arrays."""
+    predicted: str
+    shifts: tuple
+
+    def __call__(self, actual, previous_hour, predicted_load):
+        next = actual.copy()
+        next[self.predicted] = predicted_load
+        for (column, prior) in self.shifts:
+            next[column] = previous_hour[prior].iloc[0]
+        return next
+
+    @property
+    def columns(self):
+        columns = [self.predicted]
+        for pair in self.shifts:
+            columns.extend(pair)
+        return list(dict.fromkeys(columns))
+
+def arrow_file(path):
+    """An uncompressed Arrow IPC (Feather v2) copy of the parquet file at path,
+    which unlike parquet can be memory-mapped. It is written next to the
+    parquet on first use and rewritten whenever the parquet is newer."""
+    arrow_path = str(Path(path).with_suffix('.arrow'))
+    if not isfile(arrow_path) or getmtime(arrow_path) < getmtime(path):
+        write = partial(feather.write_feather, pq.read_table(path), compression='uncompressed')
+        atomic_write(arrow_path, write)
+    return arrow_path
+
+def _scaled(mean, std, X):
+    values = np.array(X, dtype=np.float32)
+    values -= mean
+    values /= std
+    return values
+
+@dataclass
+class Scaler():
+    """Per-column mean and (sample) standard deviation, as
+    (df - df.mean()) / df.std() would use. apply and invert work in place on
+    float32 arrays whose last axis holds the given columns."""
+    columns: list[str]
+    mean: np.ndarray
+    std: np.ndarray
+    count: int
+
+    @staticmethod
+    def fit(batches, columns):
+        """One pass over pyarrow record batches, merging each batch's
+        count, mean and sum of squared deviations (Chan et al.)"""
+        count = 0
+        mean = np.zeros(len(columns))
+        m2 = np.zeros(len(columns))
+        for batch in batches:
+            values = np.column_stack([batch.column(c).to_numpy(zero_copy_only=False).astype(np.float64)
+                                      for c in columns])
+            n = values.shape[0]
+            if n == 0:
+                continue
+            batch_mean = values.mean(axis=0)
+            delta = batch_mean - mean
+            total = count + n
+            mean = mean + delta * (n / total)
+            m2 = m2 + ((values - batch_mean)**2).sum(axis=0) + delta**2 * (count * n / total)
+            count = total
+        std = np.sqrt(m2 / (count - 1)) if count > 1 else np.full(len(columns), np.nan)
+        return Scaler(list(columns), mean, std, count)
+
+    def __stats(self, columns):
+        if columns is None:
+            return (self.mean.astype(np.float32), self.std.astype(np.float32))
+        positions = [self.columns.index(c) for c in columns]
+        return (self.mean[positions].astype(np.float32), self.std[positions].astype(np.float32))
+
+    def apply(self, values: np.ndarray, columns = None):
+        """Scales values in place; columns defaults to all of them"""
+        (mean, std) = self.__stats(columns)
+        values -= mean
+        values /= std
+        return values
+
+    def invert(self, values: np.ndarray, columns = None):
+        """Undoes apply in place, e.g. on predictions of a scaled target"""
+        (mean, std) = self.__stats(columns)
+        values *= std
+        values += mean
+        return values
+
+    def transformer(self, columns = None):
+        """A stateless sklearn transformer scaling frames of the columns with
+        these statistics, for a pipeline that is refit without rescanning, e.g.
+        make_pipeline(ds.scaler.transformer(features), KNeighborsRegressor())"""
+        from sklearn.preprocessing import FunctionTransformer
+        return FunctionTransformer(partial(_scaled, *self.__stats(columns)))
+
+    def save(self, path, **key):
+        atomic_write(path, json.dumps({'key': key, 'columns': self.columns, 'mean': self.mean.tolist(),
+                                       'std': self.std.tolist(), 'count': self.count}, indent=0).encode())
+
+    @staticmethod
+    def load(path, **key):
+        """The saved Scaler, or None if there is none saved under the same key"""
+        if not isfile(path):
+            return None
+        with open(path) as f:
+            saved = json.load(f)
+        if saved['key'] != json.loads(json.dumps(key)):
+            return None
+        return Scaler(saved['columns'], np.array(saved['mean']), np.array(saved['std']), saved['count'])
 
 @dataclass
 class DataSet():
@@ -15,23 +139,24 @@ class DataSet():
     validation_end: datetime
     train_start: datetime
     train_end: datetime
-    
-    data: InitVar[pd.DataFrame] = None
-    validation_data: InitVar[pd.DataFrame] = None
-    test_data: InitVar[pd.DataFrame] = None
 
     def __init__(self, path, mtlf, actual, features = None) -> None:
-        self.data = pd.read_parquet(path)
+        self.path = arrow_file(path)
         self.mtlf = mtlf
         self.actual = actual
+        if not self.index_columns:
+            raise ValueError(f'{path} has no stored index; DataSet needs a DatetimeIndex of hours')
         if not features:
-            self.features = self.data.drop([mtlf, actual], axis=1).columns.to_list()
+            excluded = [mtlf, actual] + self.index_columns
+            self.features = [c for c in self.table.column_names if c not in excluded]
         else:
             self.features = features
 
-        hours = self.data.index.to_series()
-        first_hour = hours.iloc[0]
-        last_hour = hours.iloc[-1]
+        hours = self.table.select(self.index_columns).to_pandas().index
+        if not isinstance(hours, pd.DatetimeIndex):
+            raise ValueError(f'{path} is indexed by {hours.dtype}; DataSet needs a DatetimeIndex of hours')
+        first_hour = hours[0]
+        last_hour = hours[-1]
 
         self.test_start = last_hour - timedelta(days=364, hours=23)
         self.test_end = last_hour
@@ -40,33 +165,78 @@ class DataSet():
         self.train_start = first_hour
         self.train_end = self.validation_start - timedelta(hours=1)
 
-        self.validation_data = self.data[self.validation_start:self.validation_end]
-        self.test_data = self.data[self.test_start:self.test_end]
-        self.train_data = self.data[self.train_start:self.train_end]
+    @cached_property
+    def table(self):
+        """The memory-mapped file; columns are only paged in when read"""
+        return feather.read_table(self.path, memory_map=True)
+
+    @cached_property
+    def index_columns(self):
+        """The stored index columns; none for a RangeIndex or a file not written by pandas"""
+        metadata = self.table.schema.pandas_metadata
+        if metadata is None:
+            return []
+        return [c for c in metadata['index_columns'] if isinstance(c, str)]
+
+    @property
+    def columns(self):
+        """The columns loaded into data"""
+        return list(dict.fromkeys(self.features + [self.mtlf, self.actual]))
+
+    @cached_property
+    def data(self):
+        """The columns over the index, read-only: the numeric columns without
+        nulls are views of the memory-mapped file, so assigning into them
+        raises. Take a copy() to modify them."""
+        # one block per column, so numeric columns without nulls are not copied
+        return self.table.select(self.index_columns + self.columns).to_pandas(split_blocks=True)
+
+    @cached_property
+    def validation_data(self):
+        return self.data[self.validation_start:self.validation_end]
+
+    @cached_property
+    def test_data(self):
+        return self.data[self.test_start:self.test_end]
+
+    @cached_property
+    def train_data(self):
+        return self.data[self.train_start:self.train_end]
+
+    @cached_property
+    def scaler(self):
+        """Statistics of the columns over the train rows. They are computed
+        once, streaming over the file, and saved next to it; they are read back
+        while the file and the training window stay the same."""
+        path = str(Path(self.path).with_suffix('.scaler.json'))
+        key = {'columns': self.columns, 'train_start': str(self.train_start), 'train_end': str(self.train_end)}
+        scaler = Scaler.load(path, **key) if isfile(path) and getmtime(path) >= getmtime(self.path) else None
+        if scaler is None:
+            rows = self.data.index.searchsorted(self.train_end, side='right')
+            batches = self.table.slice(0, rows).select(self.columns).to_batches(max_chunksize=1 << 16)
+            scaler = Scaler.fit(batches, self.columns)
+            scaler.save(path, **key)
+        return scaler
 
 @dataclass
 class Zone1(DataSet):
     num_hours_prior = 32
     correlated_prior_hours = [1, 2, 23, 24, 25]
+    next_hour = LagRecursion(prior_load_colname(1),
+                             tuple((prior_load_colname(i), prior_load_colname(i-1))
+                                   for i in correlated_prior_hours[1:]))
 
-    @staticmethod
-    def next_hour(actual, previous_hour, predicted_load):
-        colname = Zone1.prior_load_colname
-        next = actual.copy()
-        next[colname(1)] = predicted_load
-        for i in Zone1.correlated_prior_hours[1:]:
-            next[colname(i)] = previous_hour[colname(i-1)].iloc[0]
-        return next
-
-    @staticmethod
-    def prior_load_colname(i):
-        return f"Actual Load {i} hours prior"
+    prior_load_colname = staticmethod(prior_load_colname)
 
     def __init__(self, path, features=None) -> None:
         uncorrelated_features = ['DayOfYear', 'IsBusinessHour', 'HourEnding']
         features = self.correlated_columns + uncorrelated_features
         super().__init__(path, 'LRZ1 MTLF (MWh)', 'LRZ1 ActualLoad (MWh)', features)
 
+    @property
+    def columns(self):
+        return list(dict.fromkeys(super().columns + self.next_hour.columns))
+
     @cached_property
     def correlated_columns(self):
         return [Zone1.prior_load_colname(i) for i in Zone1.correlated_prior_hours]
@@ -0,0 +1,161 @@
+"""Builds the per-zone feature tables read by datasets.DataSet (e.g.
+data/zone1_prior_load.parquet) from the MISO zonal load reports and ASOS
+temperatures, for every load resource zone.
+
+Each zone keeps a store of one parquet file per market day alongside a manifest
+of the digest of the inputs each day was computed from, so rebuilding only
+recomputes the days whose inputs (or lags) changed.
+
+    python feature_store.py 2015-02-01 2022-03-31 --output-dir ./data/features
+"""
+from datetime import datetime
+from functools import partial
+from genericpath import isfile
+from hashlib import sha256
+from pathlib import Path
+import json
+import numpy as np
+import pandas as pd
+from pyarrow.dataset import dataset, field
+from calendar_features import is_business_hour
+from datasets import prior_load_colname
+from market_time import prevailing_time
+from MISO import MarketReports
+from util import atomic_write
+from weather_data import ASOS
+
+# bump whenever the features computed from the same inputs change
+version = 1
+
+# the temperature columns for each zone of MarketReports.zonal_hourly_load
+zone_stations = {'LRZ1'     : ['MSP'],
+                 'LRZ2_7'   : ['MKE', 'DET'],
+                 'LRZ3_5'   : ['DSM', 'STL'],
+                 'LRZ4'     : ['PIA'],
+                 'LRZ6'     : ['IND'],
+                 'LRZ8_9_10': ['LIT', 'BTR', 'HKS']}
+
+def prior_loads(load: pd.Series, num_hours_prior: int):
+    """load.shift(i) for i from num_hours_prior down to 1, as one frame"""
+    padded = np.concatenate([np.full(num_hours_prior, np.nan), load.to_numpy(dtype=np.float64)])
+    lags = np.lib.stride_tricks.sliding_window_view(padded, num_hours_prior)[:len(load)]
+    return pd.DataFrame(lags, index=load.index,
+                        columns=[prior_load_colname(i) for i in range(num_hours_prior, 0, -1)])
+
+class FeatureStore():
+    def __init__(self, output_dir, mtlf_dir = './data/mtlf', weather_dir = './data/asos',
+                 zones = None, num_hours_prior = 32) -> None:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        self.output_dir = output_dir
+        self.mtlf_dir = mtlf_dir
+        self.weather_dir = weather_dir
+        self.zones = zones or zone_stations
+        self.num_hours_prior = num_hours_prior
+
+    def path(self, zone):
+        """The parquet a DataSet reads for the zone, e.g.
+        Zone1(store.path('LRZ1')) or
+        DataSet(store.path(zone), f'{zone} MTLF (MWh)', f'{zone} ActualLoad (MWh)')"""
+        return f'{self.output_dir}/{zone}.parquet'
+
+    def build(self, first_hour: datetime, last_hour: datetime):
+        """Brings every zone's table up to date for [first_hour, last_hour]
+        and returns the path of each, keyed by zone"""
+        loads = MarketReports(self.mtlf_dir).zonal_hourly_load(first_hour, last_hour)
+        temps = self.__temperatures(first_hour, last_hour)
+        inputs = temps.join(loads, how='inner')
+        return {zone: self.__build_zone(zone, inputs, first_hour, last_hour) for zone in self.zones}
+
+    def __temperatures(self, first_hour, last_hour):
+        Path(self.weather_dir).mkdir(parents=True, exist_ok=True)
+        asos = ASOS()
+        ids = list(dict.fromkeys(id for stations in self.zones.values() for id in stations))
+        return pd.concat([asos.get_hourly_observations(id, first_hour, last_hour, self.weather_dir)
+                          for id in ids]).pivot(columns='station', values='temp')
+
+    def __columns(self, zone):
+        return (self.zones[zone] + ['Market Day', 'HourEnding',
+                                    f'{zone} MTLF (MWh)', f'{zone} ActualLoad (MWh)'])
+
+    def __digests(self, zone, inputs):
+        """Each market day's digest covers its own input rows and the
+        num_hours_prior rows before it that its lags are taken from"""
+        rows = pd.util.hash_pandas_object(inputs, index=True).to_numpy()
+        salt = json.dumps([version, self.num_hours_prior, self.__columns(zone)]).encode()
+        days = inputs['Market Day'].dt.strftime('%Y%m%d').to_numpy()
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        ends = np.r_[starts[1:], len(days)]
+        return {days[s]: sha256(salt + rows[max(0, s - self.num_hours_prior):e].tobytes()).hexdigest()
+                for (s, e) in zip(starts, ends)}
+
+    def __features(self, zone, inputs):
+        actual = f'{zone} ActualLoad (MWh)'
+        features = inputs[self.zones[zone]].copy()
+        features['DayOfYear'] = inputs['Market Day'].dt.day_of_year
+        features['HourEnding'] = inputs['HourEnding']
+        features['IsBusinessHour'] = is_business_hour(inputs.index)
+        features = features.join(prior_loads(inputs[actual], self.num_hours_prior))
+        features[actual] = inputs[actual]
+        features[f'{zone} MTLF (MWh)'] = inputs[f'{zone} MTLF (MWh)']
+        features['Market Day'] = inputs['Market Day']
+        return features
+
+    def __build_zone(self, zone, inputs, first_hour, last_hour):
+        store = f'{self.output_dir}/{zone}_store'
+        Path(store).mkdir(exist_ok=True)
+        manifest_path = f'{store}/manifest.json'
+        manifest = {}
+        if isfile(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        inputs = inputs[self.__columns(zone)]
+        digests = self.__digests(zone, inputs)
+        changed = [day for (day, digest) in digests.items()
+                   if manifest.get(day) != digest or not isfile(f'{store}/{day}.parquet')]
+
+        if changed:
+            # recompute one contiguous span, starting early enough for the lags
+            days = inputs['Market Day'].dt.strftime('%Y%m%d')
+            positions = np.flatnonzero(days.isin(changed).to_numpy())
+            begin = max(0, positions[0] - self.num_hours_prior)
+            features = self.__features(zone, inputs[begin:positions[-1] + 1])
+            # rows without a full set of lags are left out, as in add_prior_load_features
+            features = features[max(0, self.num_hours_prior - begin):]
+            features = features.reset_index(names='market_hour')
+            parts = dict(tuple(features.groupby(features.pop('Market Day').dt.strftime('%Y%m%d'))))
+            for day in changed:
+                # a day without a full set of lags is stored empty, so it is not recomputed every time
+                part = parts.get(day, features[:0])
+                atomic_write(f'{store}/{day}.parquet', partial(part.to_parquet, index=False))
+                manifest[day] = digests[day]
+
+            atomic_write(manifest_path, json.dumps(manifest, indent=0, sort_keys=True).encode())
+
+        output = self.path(zone)
+        if changed or not isfile(output):
+            parts = [f'{store}/{day}.parquet' for day in digests if isfile(f'{store}/{day}.parquet')]
+            table = dataset(parts, format='parquet').to_table(
+                filter=(field('market_hour') >= pd.Timestamp(first_hour)) &
+                       (field('market_hour') <= pd.Timestamp(last_hour)))
+            df = table.to_pandas().set_index('market_hour').sort_index(kind='stable')
+            atomic_write(output, df.to_parquet)
+        return output
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='Build the zone feature tables read by datasets.DataSet')
+    parser.add_argument('first_day', type=datetime.fromisoformat)
+    parser.add_argument('last_day', type=datetime.fromisoformat)
+    parser.add_argument('--output-dir', default='./data/features')
+    parser.add_argument('--mtlf-dir', default='./data/mtlf')
+    parser.add_argument('--weather-dir', default='./data/asos')
+    parser.add_argument('--zones', nargs='*', choices=list(zone_stations))
+    args = parser.parse_args()
+
+    zones = {zone: zone_stations[zone] for zone in args.zones} if args.zones else None
+    store = FeatureStore(args.output_dir, args.mtlf_dir, args.weather_dir, zones)
+    first = prevailing_time(args.first_day.year, args.first_day.month, args.first_day.day, 0)
+    last = prevailing_time(args.last_day.year, args.last_day.month, args.last_day.day, 23)
+    for (zone, path) in store.build(first, last).items():
+        print(f'{zone}: {path}')
@@ -0,0 +1,51 @@
+"""Concurrent bulk downloads for backfills, sharing util.WebClient's retry policy"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from genericpath import isfile
+from os import replace
+import aiohttp
+import instrument
+from util import retries
+
+async def _download(session, url, path, chunk_size):
+    retry = retries.new()
+    while True:
+        try:
+            async with session.get(url) as response:
+                if retry.is_retry('GET', response.status):
+                    raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                      status=response.status, message=response.reason)
+                response.raise_for_status()
+                # written under a temporary name so an interrupted file is never mistaken for a download
+                staging = f'{path}.part'
+                with open(staging, 'wb') as f, instrument.span('http.download', url=url):
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        f.write(chunk)
+                        instrument.count('bytes_fetched', len(chunk))
+                replace(staging, path)
+                return path
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if isinstance(e, aiohttp.ClientResponseError) and not retry.is_retry('GET', e.status):
+                raise
+            retry = retry.increment('GET', url, error=e)
+            await asyncio.sleep(retry.get_backoff_time())
+
+async def fetch_all(downloads, connections=32, per_host=8, chunk_size=1 << 16):
+    """Downloads every (url, path) pair whose path does not exist yet, with at
+    most `connections` open in total and `per_host` to any one server.
+    Returns the paths in the order given."""
+    downloads = list(downloads)
+    connector = aiohttp.TCPConnector(limit=connections, limit_per_host=per_host)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*[_download(session, url, path, chunk_size)
+                               for (url, path) in downloads if not isfile(path)])
+    return [path for (_, path) in downloads]
+
+def download_all(downloads, **kwargs):
+    """Blocking fetch_all; safe to call from a notebook whose event loop is running."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(fetch_all(downloads, **kwargs))
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(asyncio.run, fetch_all(downloads, **kwargs)).result()
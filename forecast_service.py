@@ -0,0 +1,98 @@
+"""A long-running forecaster for one zone, at the horizon and cadence of
+MISO's MTLF: 168 hours ahead, refreshed every 15 minutes.
+
+The fitted model and the latest feature state stay in memory. New hours are
+folded in with update (and partial_fit, where the model has it), so a refresh
+never reloads the data or refits the model.
+
+    ds = Zone1(store.path('LRZ1'))
+    service = ForecastService(ds, KNeighborsRegressor(5, weights='distance'),
+                              ds.correlated_columns + ['DayOfYear', 'IsBusinessHour', 'HourEnding'])
+    service.serve(lambda after: store_rows(store.path('LRZ1'), after), publish)
+"""
+from datetime import timedelta
+from time import monotonic, sleep
+import numpy as np
+import pandas as pd
+from pyarrow.dataset import dataset, field
+from calendar_features import calendar_features
+from datasets import prior_load_colname
+import instrument
+
+def store_rows(path, after):
+    """The rows of a feature table (see feature_store) after the given hour"""
+    table = dataset(path, format='parquet').to_table(filter=field('market_hour') > pd.Timestamp(after))
+    return table.to_pandas().set_index('market_hour').sort_index()
+
+class ForecastService():
+    def __init__(self, dataset, model, active_features, horizon = 168, fitted = False) -> None:
+        """Fits the model to all of dataset.data unless it is already fitted"""
+        data = dataset.data
+        self.actual = dataset.actual
+        self.active_features = list(active_features)
+        self.horizon = horizon
+        self.model = model if fitted else model.fit(data[self.active_features], data[self.actual])
+
+        # lag columns are filled from the loads, actual or predicted, that many hours back
+        self.lags = {column: i for i in range(1, horizon + 1)
+                     if (column := prior_load_colname(i)) in self.active_features}
+        window = max(self.lags.values(), default=1)
+        self.loads = data[self.actual].to_numpy(dtype=np.float64)[-window:]
+        self.latest = data[self.active_features].iloc[-1]
+        self.last_hour = data.index[-1]
+
+    def update(self, rows: pd.DataFrame):
+        """Folds in the hours after last_hour; rows is in the dataset's layout"""
+        rows = rows[rows.index > self.last_hour]
+        if rows.empty:
+            return self
+        expected = pd.date_range(self.last_hour + timedelta(hours=1), periods=rows.shape[0], freq='h')
+        if not (rows.index == expected).all():
+            raise ValueError(f'new rows must continue hourly from {self.last_hour}')
+
+        if hasattr(self.model, 'partial_fit'):
+            self.model = self.model.partial_fit(rows[self.active_features], rows[self.actual])
+        loads = rows[self.actual].to_numpy(dtype=np.float64)
+        self.loads = np.concatenate([self.loads, loads])[-len(self.loads):]
+        self.latest = rows[self.active_features].iloc[-1]
+        self.last_hour = rows.index[-1]
+        return self
+
+    def forecast(self, exogenous: pd.DataFrame = None) -> pd.Series:
+        """The next horizon hours. Calendar features are computed for each
+        hour and the lag features come from the loads (predicted ones once the
+        lag reaches past last_hour). Anything else, like temperatures, is
+        taken from exogenous (e.g. a weather forecast) where given and
+        otherwise held at its latest value."""
+        hours = pd.date_range(self.last_hour + timedelta(hours=1), periods=self.horizon, freq='h')
+        X = pd.DataFrame(np.tile(self.latest.to_numpy(dtype=np.float64), (self.horizon, 1)),
+                         index=hours, columns=self.active_features)
+        calendar = calendar_features(hours)
+        calendar['HourEnding'] = hours.hour + 1
+        known = [c for c in self.active_features if c in calendar.columns]
+        X[known] = calendar[known]
+        if exogenous is not None:
+            X.update(exogenous[[c for c in self.active_features if c in exogenous.columns]])
+
+        values = X.to_numpy(dtype=np.float64)
+        positions = [self.active_features.index(c) for c in self.lags]
+        distances = np.array(list(self.lags.values()), dtype=int)
+        window = len(self.loads)
+        loads = np.concatenate([self.loads, np.empty(self.horizon)])
+        instrument.count('predict_calls', self.horizon)
+        for h in range(self.horizon):
+            values[h, positions] = loads[window + h - distances]
+            x = pd.DataFrame(values[h:h+1], columns=self.active_features)
+            loads[window + h] = np.asarray(self.model.predict(x)).reshape(-1)[0]
+        return pd.Series(loads[window:], index=hours, name=self.actual.replace('ActualLoad', 'Forecast'))
+
+    def serve(self, poll, publish, interval = timedelta(minutes=15)):
+        """Until interrupted: every interval, update with what poll(last_hour)
+        returns (None or no rows when nothing is new) and publish the forecast"""
+        while True:
+            started = monotonic()
+            rows = poll(self.last_hour)
+            if rows is not None:
+                self.update(rows)
+            publish(self.forecast())
+            sleep(max(0.0, interval.total_seconds() - (monotonic() - started)))
@@ -0,0 +1,94 @@
+"""Forecasts for every load resource zone, region and the MISO total at once.
+
+All of the series are the outputs of one model, fitted once on a shared
+feature matrix and predicted in one batched call, so the whole footprint costs
+about as much as a single zone. Estimators without multi-output support (e.g.
+GradientBoostingRegressor) are fitted per series on the same matrix.
+
+The zones do not nest in the regions (LRZ2_7 and LRZ3_5 straddle North and
+Central), but the zones and the regions each sum to the MISO total. The raw
+forecasts are reconciled to satisfy both sums by the weighted least squares
+projection onto the coherent forecasts (MinT with a diagonal covariance).
+
+    reports = MarketReports('./data/mtlf')
+    loads = hierarchy_loads(reports.zonal_hourly_load(first, last), reports.regional_hourly_load(first, last))
+    X = temps.join(calendar_features(temps.index), how='inner')
+    engine = Hierarchy(KNeighborsRegressor(5, weights='distance')).fit(X[:cutoff], loads[:cutoff])
+    forecast = engine.predict(X[cutoff:])
+"""
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from feature_store import zone_stations
+
+zones = list(zone_stations)
+regions = ['North', 'Central', 'South']
+series = zones + regions + ['MISO']
+
+def actual_colname(name):
+    return f'{name} ActualLoad (MWh)'
+
+def forecast_colname(name):
+    return f'{name} Forecast (MWh)'
+
+def hierarchy_loads(zonal: pd.DataFrame, regional: pd.DataFrame):
+    """The actual loads of every series, from MarketReports.zonal_hourly_load
+    and regional_hourly_load, on the hours both cover"""
+    columns = [actual_colname(name) for name in series]
+    zonal = zonal[[c for c in columns if c in zonal.columns]]
+    regional = regional[[c for c in columns if c in regional.columns and c not in zonal.columns]]
+    return zonal.join(regional, how='inner')[columns]
+
+def constraints(names = series):
+    """C such that C @ y == 0 for coherent y: the zones sum to MISO and the
+    regions sum to MISO"""
+    C = np.zeros((2, len(names)))
+    for (row, parts) in enumerate([zones, regions]):
+        C[row, [names.index(name) for name in parts]] = 1.0
+        C[row, names.index('MISO')] = -1.0
+    return C
+
+def reconcile(forecasts: np.ndarray, variances = None, names = series):
+    """Coherent forecasts, one row per hour and one column per series of
+    names, moved as little as possible, weighted by the variances of each
+    series' errors (equal when None)"""
+    C = constraints(names)
+    W = np.diag(np.ones(len(names)) if variances is None else np.asarray(variances, dtype=np.float64))
+    P = np.eye(len(names)) - W @ C.T @ np.linalg.solve(C @ W @ C.T, C)
+    return np.asarray(forecasts, dtype=np.float64) @ P.T
+
+def _multi_output(model):
+    if hasattr(model, '__sklearn_tags__'):
+        return model.__sklearn_tags__().target_tags.multi_output
+    if hasattr(model, '_get_tags'):
+        return model._get_tags().get('multioutput', False)
+    # e.g. models.IncrementalOLS
+    return True
+
+class Hierarchy():
+    def __init__(self, model, variances = None) -> None:
+        """variances, one per series (e.g. the squared RMSE of each in
+        validation), weight the reconciliation"""
+        self.model = model
+        self.variances = variances
+
+    def fit(self, X: pd.DataFrame, loads: pd.DataFrame):
+        """loads holds the actual load of every series (see hierarchy_loads)"""
+        Y = loads[[actual_colname(name) for name in series]].to_numpy(dtype=np.float64)
+        if _multi_output(self.model):
+            self.models_ = [self.model.fit(X, Y)]
+        else:
+            self.models_ = [clone(self.model).fit(X, Y[:, i]) for i in range(Y.shape[1])]
+        self.features_ = list(X.columns)
+        return self
+
+    def predict(self, X: pd.DataFrame, reconciled = True) -> pd.DataFrame:
+        """The forecast of every series for each row of X"""
+        X = X[self.features_]
+        if len(self.models_) == 1:
+            Yhat = np.asarray(self.models_[0].predict(X), dtype=np.float64).reshape(X.shape[0], len(series))
+        else:
+            Yhat = np.column_stack([np.asarray(model.predict(X)).reshape(-1) for model in self.models_])
+        if reconciled:
+            Yhat = reconcile(Yhat, self.variances)
+        return pd.DataFrame(Yhat, index=X.index, columns=[forecast_colname(name) for name in series])
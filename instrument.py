@@ -0,0 +1,145 @@
+"""Opt-in timing spans and counters for the data and validation hot paths.
+
+    instrument.enable()
+    walkforward(...)
+    instrument.write('walkforward.json')  # open in ui.perfetto.dev or chrome://tracing
+
+While disabled (the default) span returns a shared no-op context manager and
+count returns at once. Tasks sent to the joblib pool through
+instrument.delayed record in their worker and hand the spans and counters
+back with their result, for instrument.gather to merge.
+"""
+from contextlib import nullcontext
+from time import perf_counter_ns
+import json
+import os
+import threading
+import joblib
+
+_enabled = False
+_events = []
+_counters = {}
+_lock = threading.Lock()
+_noop = nullcontext()
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def enabled():
+    return _enabled
+
+def reset():
+    """Drops everything recorded so far"""
+    _swap([], {})
+
+def _swap(events, counters):
+    global _events, _counters
+    with _lock:
+        previous = (_events, _counters)
+        (_events, _counters) = (events, counters)
+    return previous
+
+class _Span():
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args) -> None:
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter_ns()
+        event = {'name': self.name, 'ph': 'X', 'ts': self.start / 1000, 'dur': (end - self.start) / 1000,
+                 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': self.args}
+        with _lock:
+            _events.append(event)
+
+def span(name, **args):
+    """Times the enclosed block under name; args are kept with the event"""
+    if not _enabled:
+        return _noop
+    return _Span(name, args)
+
+def count(name, n=1):
+    if not _enabled:
+        return
+    pid = os.getpid()
+    with _lock:
+        _counters[(name, pid)] = _counters.get((name, pid), 0) + n
+
+class _Recorded():
+    def __init__(self, result, events, counters) -> None:
+        self.result = result
+        self.events = events
+        self.counters = counters
+
+class _Traced():
+    """func, recording while it runs and returning what it recorded"""
+    def __init__(self, func) -> None:
+        self.func = func
+
+    def __call__(self, *args, **kwargs):
+        global _enabled
+        was_enabled = _enabled
+        # keep the task's records apart, the pool may run it in this process
+        saved = _swap([], {})
+        _enabled = True
+        try:
+            result = self.func(*args, **kwargs)
+        finally:
+            _enabled = was_enabled
+            (events, counters) = _swap(*saved)
+        return _Recorded(result, events, counters)
+
+def delayed(func):
+    """joblib.delayed, recording in the worker while instrumentation is enabled"""
+    return joblib.delayed(_Traced(func) if _enabled else func)
+
+def gather(results):
+    """The results of instrument.delayed tasks, merging what they recorded"""
+    unwrapped = []
+    for result in results:
+        if isinstance(result, _Recorded):
+            with _lock:
+                _events.extend(result.events)
+                for (key, n) in result.counters.items():
+                    _counters[key] = _counters.get(key, 0) + n
+            result = result.result
+        unwrapped.append(result)
+    return unwrapped
+
+def report():
+    """Span counts and times (ms) and counters, overall and by process"""
+    with _lock:
+        events = list(_events)
+        counters = dict(_counters)
+    spans = {}
+    for event in events:
+        for key in [event['name'], f'{event["name"]} [{event["pid"]}]']:
+            stats = spans.setdefault(key, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += event['dur'] / 1000
+            stats['max_ms'] = max(stats['max_ms'], event['dur'] / 1000)
+    totals = {}
+    for ((name, pid), n) in counters.items():
+        totals[name] = totals.get(name, 0) + n
+        totals[f'{name} [{pid}]'] = n
+    return {'spans': dict(sorted(spans.items())), 'counters': dict(sorted(totals.items()))}
+
+def write(path):
+    """Everything recorded, as a Chrome trace with the report alongside"""
+    with _lock:
+        events = list(_events)
+    processes = sorted({event['pid'] for event in events})
+    names = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+              'args': {'name': 'main' if pid == os.getpid() else f'worker {pid}'}} for pid in processes]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': names + events, 'displayTimeUnit': 'ms', **report()}, f)
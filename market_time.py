@@ -0,0 +1,21 @@
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+
+# MISO market days and hours are reported in Eastern Standard Time all year
+market_timezone = timezone(timedelta(hours=-5))
+
+def prevailing_time(yyyy, mm, dd, hh):
+    """The market hour starting at hh on the given day. Given arrays, returns
+    the equivalent DatetimeIndex without building a datetime per element."""
+    if np.ndim(yyyy) == 0:
+        return datetime(yyyy, mm, dd, hh, tzinfo=market_timezone)
+    hours = pd.to_datetime(pd.DataFrame({'year': yyyy, 'month': mm, 'day': dd, 'hour': hh}))
+    return pd.DatetimeIndex(hours).tz_localize(market_timezone)
+
+def market_hours(market_day, hour_ending):
+    """Index of market hours for report rows: Market Day + (HourEnding - 1)
+    hours, in the market timezone"""
+    days = pd.DatetimeIndex(market_day)
+    hours = pd.to_timedelta(np.asarray(hour_ending) - 1, unit='h')
+    return (days + hours).tz_localize(market_timezone)
@@ -0,0 +1,162 @@
+"""Fitted models on disk, keyed by zone, feature set, training cutoff and the
+estimator's class and hyperparameters.
+
+Estimators are written with joblib, uncompressed, so their arrays (the
+neighbours of a KNeighborsRegressor, the statistics of an IncrementalOLS) are
+memory-mapped on load rather than read. Keras models are saved in the .keras
+format. Nothing is loaded until an artifact's model is first used.
+
+A daily run fits through the registry, which reuses the day's model when it is
+already there and otherwise warm-starts from the latest earlier cutoff when the
+estimator has partial_fit, so only the hours since that cutoff are fitted:
+
+    registry = ModelRegistry()
+    model = registry.fit(IncrementalOLS(), 'LRZ1', features, cutoff, ds.data[features], ds.data[ds.actual])
+    service = ForecastService(ds, model, features, fitted=True)
+"""
+from datetime import datetime
+from functools import cached_property, partial
+from genericpath import isfile
+from pathlib import Path
+import json
+import joblib
+import pandas as pd
+from util import atomic_write
+
+def _is_keras(model):
+    return type(model).__module__.startswith(('keras', 'tensorflow', 'tf_keras'))
+
+def _unnamed(config):
+    """A Keras model's config with the names of the model and its layers,
+    which Keras numbers per session (dense, dense_1, ...), replaced by their
+    order of appearance, so the same architecture always has the same config"""
+    names = {}
+    def collect(config):
+        names.setdefault(config.get('name'), f'#{len(names)}')
+        for layer in config.get('layers', []):
+            names.setdefault(layer.get('name', layer['config'].get('name')), f'#{len(names)}')
+            collect(layer['config'])
+    def rename(value):
+        if isinstance(value, dict):
+            # the input shape is set by the features, which are keyed anyway
+            return {k: rename(v) for (k, v) in value.items() if k != 'build_config'}
+        if isinstance(value, (list, tuple)):
+            return [rename(v) for v in value]
+        return names.get(value, value) if isinstance(value, str) else value
+    collect(config)
+    return rename(config)
+
+def _params(model):
+    """The hyperparameters of an estimator: get_params, a Keras model's
+    config without its layer names, or else the attributes not ending in '_'"""
+    if hasattr(model, 'get_params'):
+        return model.get_params(deep=True)
+    if _is_keras(model):
+        return _unnamed(model.get_config())
+    return {k: v for (k, v) in vars(model).items() if not k.endswith('_')}
+
+def _cutoff(cutoff):
+    return pd.Timestamp(cutoff).isoformat()
+
+class Artifact():
+    """A saved model and what it was fitted on; model is loaded on first use"""
+    def __init__(self, path, meta, mmap_mode='r') -> None:
+        self.path = path
+        self.meta = meta
+        self.mmap_mode = mmap_mode
+
+    @property
+    def key(self):
+        return self.meta['key']
+
+    @property
+    def cutoff(self):
+        return pd.Timestamp(self.meta['cutoff'])
+
+    @cached_property
+    def model(self):
+        if self.meta['format'] == 'keras':
+            from tensorflow import keras
+            return keras.models.load_model(self.path)
+        return joblib.load(self.path, mmap_mode=self.mmap_mode)
+
+class ModelRegistry():
+    def __init__(self, folder='./data/models') -> None:
+        self.folder = folder
+        Path(folder).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def config(model):
+        """The digest of the estimator's class and hyperparameters"""
+        return joblib.hash((type(model).__module__, type(model).__qualname__, _params(model)))
+
+    @staticmethod
+    def key(zone, features, cutoff, model):
+        return joblib.hash((zone, list(features), _cutoff(cutoff), ModelRegistry.config(model)))
+
+    def __meta_path(self, zone, key):
+        return f'{self.folder}/{zone}/{key}.json'
+
+    def save(self, model, zone, features, cutoff) -> Artifact:
+        """Saves a fitted model trained on the hours up to and including cutoff"""
+        Path(f'{self.folder}/{zone}').mkdir(exist_ok=True)
+        key = ModelRegistry.key(zone, features, cutoff, model)
+        format = 'keras' if _is_keras(model) else 'joblib'
+        path = f'{self.folder}/{zone}/{key}.{format}'
+        atomic_write(path, model.save if format == 'keras' else partial(joblib.dump, model))
+
+        meta = {'key': key, 'zone': zone, 'features': list(features), 'cutoff': _cutoff(cutoff),
+                'config': ModelRegistry.config(model), 'class': type(model).__qualname__,
+                'format': format, 'saved': datetime.now().isoformat()}
+        atomic_write(self.__meta_path(zone, key), json.dumps(meta, indent=0).encode())
+        return Artifact(path, meta)
+
+    def __artifact(self, meta_path, mmap_mode):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        path = f'{Path(meta_path).parent}/{meta["key"]}.{meta["format"]}'
+        return Artifact(path, meta, mmap_mode) if isfile(path) else None
+
+    def get(self, zone, features, cutoff, model, mmap_mode='r') -> Artifact:
+        """The artifact of model (an unfitted instance with the same
+        hyperparameters will do) fitted up to cutoff, or None"""
+        meta_path = self.__meta_path(zone, ModelRegistry.key(zone, features, cutoff, model))
+        return self.__artifact(meta_path, mmap_mode) if isfile(meta_path) else None
+
+    def latest(self, zone, features, model, before, mmap_mode='r') -> Artifact:
+        """The artifact of model with the latest cutoff before the given one, or None"""
+        (config, features, before) = (ModelRegistry.config(model), list(features), pd.Timestamp(before))
+        best = None
+        # names starting with '_' are files still being written (see atomic_write)
+        for meta_path in Path(f'{self.folder}/{zone}').glob('[!_]*.json'):
+            artifact = self.__artifact(meta_path, mmap_mode)
+            if (artifact is None or artifact.meta['config'] != config
+                    or artifact.meta['features'] != features or artifact.cutoff >= before):
+                continue
+            if best is None or artifact.cutoff > best.cutoff:
+                best = artifact
+        return best
+
+    def fit(self, model, zone, features, cutoff, X, y):
+        """model fitted on the rows of X and y (indexed by hour) up to
+        cutoff: the saved one if there is one, else the latest earlier one
+        brought forward with partial_fit on the hours since its cutoff, else
+        a full fit. A new fit is saved. Keras models are fitted in place
+        (fit returns their History), with fit's defaults. The arrays of a
+        saved model are mapped copy-on-write, so it can still be updated with
+        partial_fit."""
+        saved = self.get(zone, features, cutoff, model, mmap_mode='c')
+        if saved is not None:
+            return saved.model
+        cutoff = pd.Timestamp(cutoff)
+        X = X[list(features)]
+        previous = self.latest(zone, features, model, cutoff, mmap_mode='c') if hasattr(model, 'partial_fit') else None
+        if previous is not None:
+            since = (X.index > previous.cutoff) & (X.index <= cutoff)
+            fitted = previous.model.partial_fit(X[since], y[since])
+        else:
+            fitted = model.fit(X[X.index <= cutoff], y[y.index <= cutoff])
+            if _is_keras(model):
+                fitted = model
+        self.save(fitted, zone, features, cutoff)
+        return fitted
@@ -0,0 +1,27 @@
+import numpy as np
+
+class IncrementalOLS():
+    """Ordinary least squares (no constant, like sm.OLS) kept as the sufficient
+    statistics X'X and X'y. partial_fit with a day of new hours is a rank-24
+    update, so walkforward(..., incremental=True) never revisits the history.
+    y may also be 2-D, one column per output, as in walkforward(..., direct=True)."""
+
+    def fit(self, X, y):
+        self.xtx_ = np.zeros((X.shape[1], X.shape[1]))
+        self.xty_ = np.zeros((X.shape[1],) + np.shape(y)[1:])
+        self.n_samples_ = 0
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y):
+        if not hasattr(self, 'xtx_'):
+            return self.fit(X, y)
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.xtx_ += X.T @ X
+        self.xty_ += X.T @ y
+        self.n_samples_ += X.shape[0]
+        self.coef_ = np.linalg.lstsq(self.xtx_, self.xty_, rcond=None)[0]
+        return self
+
+    def predict(self, x):
+        return np.asarray(x, dtype=np.float64) @ self.coef_
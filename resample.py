@@ -0,0 +1,79 @@
+"""Array kernels for putting irregular observations on an hourly grid"""
+import numpy as np
+
+def nearest(times, hours, tolerance):
+    """Position in the sorted, unique `times` of the observation nearest each
+    of `hours`, or -1 if none is within `tolerance`. Same selection as
+    reindex(method='nearest', tolerance=...): a tie goes to the later time."""
+    after = np.searchsorted(times, hours, side='left')
+    before = np.searchsorted(times, hours, side='right') - 1
+    has_after = after < times.shape[0]
+    has_before = before >= 0
+    after_distance = np.where(has_after, times[np.minimum(after, times.shape[0] - 1)] - hours, tolerance)
+    before_distance = np.where(has_before, hours - times[np.maximum(before, 0)], tolerance)
+    use_before = has_before & (~has_after | (before_distance < after_distance))
+    indexer = np.where(use_before, before, after)
+    distance = np.where(use_before, before_distance, after_distance)
+    return np.where((has_before | has_after) & (distance <= tolerance), indexer, -1)
+
+def _secant(x0, y0, x1, y1):
+    return (y1 - y0) / (x1 - x0)
+
+def _interior_slope(h0, m0, h1, m1):
+    """Derivative at a knot from the secants m0, m1 over the intervals h0, h1
+    either side of it, as in scipy's PchipInterpolator"""
+    w0 = h0 + 2*h1
+    w1 = h1 + 2*h0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (w0 + w1) / (w0/m0 + w1/m1)
+    return np.where((np.sign(m0) != np.sign(m1)) | (m0 == 0) | (m1 == 0), 0.0, slope)
+
+def _edge_slope(h0, m0, h1, m1):
+    """Derivative at an end knot from its interval h0, m0 and the next one in"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = ((2*h0 + h1)*m0 - h0*m1) / (h0 + h1)
+    slope = np.where(np.sign(slope) != np.sign(m0), 0.0, slope)
+    return np.where((np.sign(m0) != np.sign(m1)) & (np.abs(slope) > 3*np.abs(m0)), 3*m0, slope)
+
+def fill_gaps(values):
+    """Fills the NaN runs inside each column of a 2-D (hours, stations) array
+    with the piecewise cubic Hermite (PCHIP) interpolant through that column's
+    observations. Only the two observations either side of a gap, and their
+    neighbours, are involved, so the work is proportional to the gap cells.
+    Gaps before the first or after the last observation stay NaN.
+
+    Returns the filled copy and the boolean mask of the cells filled."""
+    values = np.array(values, dtype=np.float64)
+    n = values.shape[0]
+    known = ~np.isnan(values)
+    rows = np.arange(n)[:, None]
+    prior = np.maximum.accumulate(np.where(known, rows, -1), axis=0)
+    next = np.minimum.accumulate(np.where(known, rows, n)[::-1], axis=0)[::-1]
+
+    (i, j) = np.nonzero(~known & (prior >= 0) & (next < n))
+    (left, right) = (prior[i, j], next[i, j])
+    left_prior = np.where(left > 0, prior[np.maximum(left - 1, 0), j], -1)
+    right_next = np.where(right < n - 1, next[np.minimum(right + 1, n - 1), j], n)
+    (has_left_prior, has_right_next) = (left_prior >= 0, right_next < n)
+
+    (y_left, y_right) = (values[left, j], values[right, j])
+    h = (right - left).astype(np.float64)
+    m = _secant(left, y_left, right, y_right)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_left = (left - left_prior).astype(np.float64)
+        m_left = _secant(left_prior, values[np.maximum(left_prior, 0), j], left, y_left)
+        h_right = (right_next - right).astype(np.float64)
+        m_right = _secant(right, y_right, right_next, values[np.minimum(right_next, n - 1), j])
+
+    # with only two observations in the column the interpolant is a line
+    d_left = np.where(has_left_prior, _interior_slope(h_left, m_left, h, m),
+                      np.where(has_right_next, _edge_slope(h, m, h_right, m_right), m))
+    d_right = np.where(has_right_next, _interior_slope(h, m, h_right, m_right),
+                       np.where(has_left_prior, _edge_slope(h, m, h_left, m_left), m))
+
+    t = (i - left) / h
+    values[i, j] = ((2*t**3 - 3*t**2 + 1)*y_left + (t**3 - 2*t**2 + t)*h*d_left
+                    + (-2*t**3 + 3*t**2)*y_right + (t**3 - t**2)*h*d_right)
+    interpolated = np.zeros(values.shape, dtype=bool)
+    interpolated[i, j] = True
+    return (values, interpolated)
@@ -0,0 +1,134 @@
+"""Station weights for turning hourly ASOS temperatures into zone temperatures,
+built once from the station coordinates with a ball tree (great circle
+distance).
+
+A weight matrix is sparse, one row per zone (or station) and one column per
+station of the index, so aggregating every hour is one sparse product; hours
+where some stations are missing are renormalized over the ones reporting.
+
+    index = ASOS().station_index
+    weights = index.zone_weights()
+    temps = index.aggregate(hourly, weights, list(zone_centers))  # hourly: hours x station ids
+    (filled, interpolated) = index.fill_gaps(hourly)
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.neighbors import BallTree
+
+earth_radius_miles = 3958.8
+
+# the larger metro areas of each load resource zone (see feature_store.zone_stations),
+# as (latitude, longitude, approximate population in millions)
+zone_centers = {'LRZ1'     : [(44.98, -93.27, 3.69),  # Minneapolis-St. Paul
+                              (46.79, -92.10, 0.29),  # Duluth
+                              (46.88, -96.79, 0.25),  # Fargo
+                              (44.02, -92.47, 0.23),  # Rochester
+                              (43.54, -96.73, 0.28)], # Sioux Falls
+                'LRZ2_7'   : [(43.04, -87.91, 1.57),  # Milwaukee
+                              (43.07, -89.40, 0.68),  # Madison
+                              (44.51, -88.01, 0.33),  # Green Bay
+                              (42.33, -83.05, 4.34),  # Detroit
+                              (42.96, -85.67, 1.09),  # Grand Rapids
+                              (42.73, -84.56, 0.54)], # Lansing
+                'LRZ3_5'   : [(41.59, -93.62, 0.72),  # Des Moines
+                              (41.98, -91.67, 0.27),  # Cedar Rapids
+                              (41.52, -90.58, 0.38),  # Quad Cities
+                              (38.63, -90.20, 2.80),  # St. Louis
+                              (38.95, -92.33, 0.21)], # Columbia
+                'LRZ4'     : [(40.69, -89.59, 0.40),  # Peoria
+                              (39.78, -89.65, 0.21),  # Springfield
+                              (40.12, -88.24, 0.23),  # Champaign-Urbana
+                              (40.48, -88.99, 0.17)], # Bloomington-Normal
+                'LRZ6'     : [(39.77, -86.16, 2.11),  # Indianapolis
+                              (37.97, -87.57, 0.31),  # Evansville
+                              (41.08, -85.14, 0.42),  # Fort Wayne
+                              (41.68, -86.25, 0.32)], # South Bend
+                'LRZ8_9_10': [(34.75, -92.29, 0.75),  # Little Rock
+                              (30.45, -91.19, 0.87),  # Baton Rouge
+                              (29.95, -90.07, 1.27),  # New Orleans
+                              (32.53, -93.75, 0.39),  # Shreveport
+                              (30.22, -92.02, 0.48),  # Lafayette
+                              (30.08, -94.13, 0.39),  # Beaumont
+                              (32.30, -90.18, 0.59)]} # Jackson
+
+class StationIndex():
+    def __init__(self, stations: pd.DataFrame) -> None:
+        """stations has the 'sid' and (latitude, longitude) 'latlon' columns of ASOS.stations"""
+        stations = stations.drop_duplicates('sid')
+        self.ids = list(stations['sid'])
+        self.positions = {id: i for (i, id) in enumerate(self.ids)}
+        self.latlon = np.array(stations['latlon'].tolist(), dtype=np.float64).reshape(-1, 2)
+        self.tree = BallTree(np.radians(self.latlon), metric='haversine')
+
+    def subset(self, ids):
+        return StationIndex(pd.DataFrame({'sid': list(ids), 'latlon': [tuple(self.latlon[self.positions[id]])
+                                                                       for id in ids]}))
+
+    def nearest(self, latlon, k):
+        """(miles, positions) of the k stations nearest each (latitude, longitude)"""
+        (distances, positions) = self.tree.query(np.radians(np.asarray(latlon, dtype=np.float64).reshape(-1, 2)),
+                                                 k=min(k, len(self.ids)))
+        return (distances * earth_radius_miles, positions)
+
+    def weights(self, latlon, k = 4, radius_miles = None, power = 2.0, exclude_self = False):
+        """Inverse distance weights (to the power) of the k stations nearest
+        each point, within radius_miles if given; each row sums to one, or is
+        empty when no station is in range. With exclude_self the points are
+        this index's stations, in order, and each leaves itself out."""
+        if exclude_self:
+            k = min(k, len(self.ids) - 1)
+        (miles, positions) = self.nearest(latlon, k + 1 if exclude_self else k)
+        if exclude_self:
+            rows = np.arange(miles.shape[0])[:, None]
+            others = positions != rows
+            # a station always finds itself, so drop it, or else the farthest of k + 1
+            keep = others & (np.cumsum(others, axis=1) <= k)
+            (miles, positions) = (miles[keep].reshape(-1, k), positions[keep].reshape(-1, k))
+        # stations on top of a point would get all of its weight anyway
+        w = 1.0 / np.maximum(miles, 1.0)**power
+        if radius_miles is not None:
+            w[miles > radius_miles] = 0.0
+        totals = w.sum(axis=1, keepdims=True)
+        w = np.divide(w, totals, out=np.zeros_like(w), where=totals > 0)
+        rows = np.repeat(np.arange(w.shape[0]), w.shape[1])
+        matrix = sparse.csr_matrix((w.ravel(), (rows, positions.ravel())), shape=(w.shape[0], len(self.ids)))
+        matrix.eliminate_zeros()
+        return matrix
+
+    def zone_weights(self, centers = None, k = 3, radius_miles = 100, power = 2.0):
+        """(zones, stations) weights: each zone's metro areas weighted by
+        population, and each metro area by its nearest stations"""
+        centers = centers or zone_centers
+        points = [(lat, lon) for places in centers.values() for (lat, lon, _) in places]
+        population = np.array([p for places in centers.values() for (_, _, p) in places], dtype=np.float64)
+        zone = np.repeat(np.arange(len(centers)), [len(places) for places in centers.values()])
+        shares = population / np.bincount(zone, weights=population)[zone]
+        by_zone = sparse.csr_matrix((shares, (zone, np.arange(len(points)))), shape=(len(centers), len(points)))
+        return (by_zone @ self.weights(points, k, radius_miles, power)).tocsr()
+
+    def aggregate(self, temps: pd.DataFrame, weights, names):
+        """The weighted temperatures of each row of weights (named by names)
+        for every hour of temps, whose columns are station ids of the index.
+        Each hour is renormalized over the stations that have a value; it is
+        NaN when none of a row's stations do."""
+        columns = weights.tocsc()[:, [self.positions[id] for id in temps.columns]].tocsr()
+        values = temps.to_numpy(dtype=np.float64)
+        known = ~np.isnan(values)
+        numerator = columns @ np.where(known, values, 0.0).T
+        denominator = columns @ known.T.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aggregated = numerator / denominator
+        return pd.DataFrame(aggregated.T, index=temps.index, columns=list(names))
+
+    def fill_gaps(self, temps: pd.DataFrame, k = 3, radius_miles = 60, power = 2.0):
+        """Fills each station's missing hours from its k nearest neighbours
+        among the columns of temps. Returns the filled copy and the boolean
+        frame of the cells filled."""
+        ids = list(temps.columns)
+        neighbours = self.subset(ids)
+        weights = neighbours.weights(neighbours.latlon, k, radius_miles, power, exclude_self=True)
+        estimates = neighbours.aggregate(temps, weights, ids)
+        missing = temps.isna()
+        filled = temps.mask(missing, estimates)
+        return (filled, missing & filled.notna())
@@ -0,0 +1,69 @@
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules live at the top of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            # each route is a list of (status, body), the last one repeating
+            responses = server.routes.get(self.path, [(404, b'')])
+            (status, body) = responses.pop(0) if len(responses) > 1 else responses[0]
+        try:
+            time.sleep(server.delay)
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def http_server():
+    """A local stand-in for the report and ASOS servers"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.daemon_threads = True
+    server.routes = {}
+    server.requests = []
+    server.lock = threading.Lock()
+    server.active = 0
+    server.peak = 0
+    server.delay = 0.0
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def zone_frame():
+    """Builds a synthetic zone in the layout of the feature tables: hourly
+    temperatures of the stations, HourEnding, and the zone's MTLF and actual
+    load, which follow the temperatures"""
+    def build(days=30, stations=('MSP',), seed=0, zone='LRZ1'):
+        rng = np.random.default_rng(seed)
+        index = pd.date_range('2019-01-01', periods=24*days, freq='h', tz='EST', name='market_hour')
+        temps = rng.normal(40, 10, (len(index), len(stations)))
+        load = 9000 + temps @ rng.normal(0, 20, len(stations))
+        df = pd.DataFrame(temps, index=index, columns=list(stations))
+        df['HourEnding'] = index.hour + 1
+        df[f'{zone} MTLF (MWh)'] = load + rng.normal(0, 100, len(index))
+        df[f'{zone} ActualLoad (MWh)'] = load + rng.normal(0, 50, len(index))
+        return df
+    return build
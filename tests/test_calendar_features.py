@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+from calendar_features import calendar_features, fourier_features, is_business_hour
+
+hours = pd.date_range('2019-12-30', '2020-01-03 23:00', freq='h')
+
+@pytest.mark.parametrize('unit', ['s', 'ms', 'us'])
+@pytest.mark.parametrize('tz', [None, 'EST'])
+def test_any_index_unit(unit, tz):
+    index = hours if tz is None else hours.tz_localize(tz)
+    expected = calendar_features(index)
+    pd.testing.assert_frame_equal(calendar_features(index.as_unit(unit)).reset_index(drop=True),
+                                  expected.reset_index(drop=True))
+
+def test_new_years_day_is_a_holiday():
+    features = calendar_features(hours.as_unit('us'))
+    assert features.loc['2020-01-01', 'IsHoliday'].eq(1).all()
+    assert features.loc['2020-01-02', 'IsHoliday'].eq(0).all()
+
+def test_matches_pandas_offsets():
+    from pandas.tseries.holiday import USFederalHolidayCalendar
+    from pandas.tseries.offsets import BusinessHour, CustomBusinessDay
+    day = CustomBusinessDay(calendar=USFederalHolidayCalendar())
+    hour = BusinessHour()
+    expected = [int(day.is_on_offset(h) and hour.is_on_offset(h)) for h in hours]
+    assert is_business_hour(hours.as_unit('us')).tolist() == expected
+
+def test_fourier_features_use_the_timestamp():
+    timestamps = hours.to_series().map(pd.Timestamp.timestamp).to_numpy()
+    features = fourier_features(hours.as_unit('us'))
+    np.testing.assert_array_equal(features['Daily sin'].to_numpy(), np.sin(timestamps * (2 * np.pi / 86400)))
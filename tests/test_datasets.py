@@ -0,0 +1,41 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from datasets import DataSet
+
+mtlf = 'LRZ1 MTLF (MWh)'
+actual = 'LRZ1 ActualLoad (MWh)'
+
+def test_same_splits_as_read_parquet(tmp_path, zone_frame):
+    df = zone_frame(days=3*365)
+    df.to_parquet(tmp_path / 'zone.parquet')
+    ds = DataSet(str(tmp_path / 'zone.parquet'), mtlf, actual)
+    assert ds.features == ['MSP', 'HourEnding']
+    df = pd.read_parquet(tmp_path / 'zone.parquet')
+    pd.testing.assert_frame_equal(ds.data, df[ds.columns])
+    assert ds.test_end == df.index[-1]
+    assert len(ds.test_data) == 365*24
+    assert len(ds.validation_data) == 365*24
+    pd.testing.assert_frame_equal(ds.train_data, df[ds.columns][:ds.train_end])
+
+def test_data_is_read_only(tmp_path, zone_frame):
+    zone_frame(days=3*365).to_parquet(tmp_path / 'zone.parquet')
+    ds = DataSet(str(tmp_path / 'zone.parquet'), mtlf, actual)
+    with pytest.raises(ValueError, match='read-only'):
+        ds.data.iloc[0, 0] = 0.0
+    data = ds.data.copy()
+    data.iloc[0, 0] = 0.0
+
+@pytest.mark.parametrize('strip', [False, True])
+def test_no_stored_index_is_refused(tmp_path, strip, zone_frame):
+    df = zone_frame(days=10).reset_index(drop=True)
+    table = pa.Table.from_pandas(df)
+    pq.write_table(table.replace_schema_metadata(None) if strip else table, tmp_path / 'zone.parquet')
+    with pytest.raises(ValueError, match='needs a DatetimeIndex'):
+        DataSet(str(tmp_path / 'zone.parquet'), mtlf, actual)
+
+def test_other_stored_index_is_refused(tmp_path, zone_frame):
+    zone_frame(days=10).set_index('HourEnding', append=True).reset_index(level=0).to_parquet(tmp_path / 'zone.parquet')
+    with pytest.raises(ValueError, match='needs a DatetimeIndex'):
+        DataSet(str(tmp_path / 'zone.parquet'), mtlf, actual)
@@ -0,0 +1,52 @@
+from pathlib import Path
+import pandas as pd
+import pytest
+import feature_store
+from feature_store import FeatureStore
+
+build_zone = FeatureStore._FeatureStore__build_zone
+
+@pytest.fixture
+def inputs(zone_frame):
+    df = zone_frame(days=8)
+    df['Market Day'] = df.index.tz_localize(None).normalize()
+    return df
+
+@pytest.fixture
+def writes(monkeypatch):
+    """The paths written, by name"""
+    written = []
+    atomic_write = feature_store.atomic_write
+    def record(path, data):
+        written.append(Path(path).name)
+        atomic_write(path, data)
+    monkeypatch.setattr(feature_store, 'atomic_write', record)
+    return written
+
+def _build(store, inputs):
+    return build_zone(store, 'LRZ1', inputs, inputs.index[0], inputs.index[-1])
+
+def test_default_folders_are_created(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    FeatureStore('./data/features')
+    assert (tmp_path / 'data' / 'features').is_dir()
+
+def test_rebuild_rewrites_only_the_days_changed(tmp_path, inputs, writes):
+    store = FeatureStore(str(tmp_path))
+    first = pd.read_parquet(_build(store, inputs))
+    # rows without a full set of lags are left out
+    assert first.index[0] == inputs.index[store.num_hours_prior]
+
+    writes.clear()
+    _build(store, inputs)
+    assert writes == []
+
+    # an early load of a day is a lag of the rest of the day and of the next one
+    changed = inputs.copy()
+    changed.loc[changed.index[24*4 + 5], 'LRZ1 ActualLoad (MWh)'] += 100.0
+    second = pd.read_parquet(_build(store, changed))
+    assert sorted(writes) == ['20190105.parquet', '20190106.parquet', 'LRZ1.parquet', 'manifest.json']
+
+    fresh = pd.read_parquet(_build(FeatureStore(str(tmp_path / 'fresh')), changed))
+    pd.testing.assert_frame_equal(second, fresh)
+    assert not second.equals(first)
@@ -0,0 +1,55 @@
+from datetime import timedelta
+import aiohttp
+import pytest
+import fetch
+
+def test_retries_503(http_server, tmp_path):
+    http_server.routes['/a'] = [(503, b''), (503, b''), (200, b'body')]
+    fetch.download_all([(f'{http_server.url}/a', f'{tmp_path}/a')])
+    assert (tmp_path / 'a').read_bytes() == b'body'
+    assert http_server.requests == ['/a'] * 3
+
+def test_no_retry_on_404(http_server, tmp_path):
+    with pytest.raises(aiohttp.ClientResponseError) as e:
+        fetch.download_all([(f'{http_server.url}/missing', f'{tmp_path}/missing')])
+    assert e.value.status == 404
+    assert http_server.requests == ['/missing']
+    assert not (tmp_path / 'missing').exists()
+    assert not (tmp_path / 'missing.part').exists()
+
+def test_skips_existing_files(http_server, tmp_path):
+    (tmp_path / 'a').write_bytes(b'kept')
+    http_server.routes['/b'] = [(200, b'new')]
+    paths = fetch.download_all([(f'{http_server.url}/a', f'{tmp_path}/a'),
+                                (f'{http_server.url}/b', f'{tmp_path}/b')])
+    assert paths == [f'{tmp_path}/a', f'{tmp_path}/b']
+    assert (tmp_path / 'a').read_bytes() == b'kept'
+    assert http_server.requests == ['/b']
+
+def test_connections_per_host_are_bounded(http_server, tmp_path):
+    http_server.delay = 0.1
+    names = [f'f{i}' for i in range(8)]
+    for name in names:
+        http_server.routes[f'/{name}'] = [(200, name.encode())]
+    fetch.download_all([(f'{http_server.url}/{name}', f'{tmp_path}/{name}') for name in names], per_host=2)
+    assert sorted(http_server.requests) == sorted(f'/{name}' for name in names)
+    assert http_server.peak == 2
+    assert all((tmp_path / name).read_bytes() == name.encode() for name in names)
+
+def test_market_reports_skip_unpublished_days(http_server, tmp_path, monkeypatch):
+    from benchmarks import write_zonal_reports
+    import MISO
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    start = MISO.prevailing_time(2024, 3, 1, 0)
+    # published through the day after the last one asked for, as on the morning after it
+    write_zonal_reports(str(reports), start.date(), 4)
+    for report in reports.iterdir():
+        http_server.routes[f'/{report.name}'] = [(200, report.read_bytes())]
+    monkeypatch.setattr(MISO.MarketReports, '_MarketReports__url', staticmethod(lambda f: f'{http_server.url}/{f}'))
+
+    end = start + timedelta(days=2, hours=23)
+    loads = MISO.MarketReports(str(tmp_path / 'mtlf')).zonal_hourly_load(start, end)
+    assert not loads.empty
+    assert all(path.endswith('_df_al.xls') for path in http_server.requests)
+    assert '/20240305_df_al.xls' not in http_server.requests
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.neighbors import KNeighborsRegressor
+from hierarchy import Hierarchy, actual_colname, hierarchy_loads, reconcile, regions, series, zones
+from models import IncrementalOLS
+
+stations = ['MSP', 'DSM', 'STL', 'IND']
+
+@pytest.fixture
+def hierarchy(zone_frame):
+    df = zone_frame(days=25, stations=stations)
+    X = df[stations]
+    # every zone's load follows the temperatures, each in its own way
+    Z = np.column_stack([df['LRZ1 ActualLoad (MWh)'] / len(zones) + 20 * (i + 1) * X.iloc[:, i % len(stations)]
+                         for i in range(len(zones))])
+    # LRZ2_7 and LRZ3_5 straddle North and Central
+    shares = np.array([[1, 0, 0], [.5, .5, 0], [.4, .6, 0], [0, 1, 0], [0, 1, 0], [0, 0, 1]])
+    zonal = pd.DataFrame(Z, index=df.index, columns=[actual_colname(z) for z in zones])
+    zonal['MISO ActualLoad (MWh)'] = Z.sum(axis=1)
+    zonal['HourEnding'] = df['HourEnding']
+    regional = pd.DataFrame(Z @ shares, index=df.index, columns=[actual_colname(r) for r in regions])
+    regional['MISO ActualLoad (MWh)'] = Z.sum(axis=1)
+    return (X, hierarchy_loads(zonal, regional))
+
+def _incoherence(forecast):
+    values = forecast.to_numpy()
+    return max(np.abs(values[:, :len(zones)].sum(axis=1) - values[:, -1]).max(),
+               np.abs(values[:, len(zones):-1].sum(axis=1) - values[:, -1]).max())
+
+def test_loads_have_every_series(hierarchy):
+    (_, loads) = hierarchy
+    assert list(loads.columns) == [actual_colname(name) for name in series]
+
+@pytest.mark.parametrize('model', [IncrementalOLS(), KNeighborsRegressor(5),
+                                   GradientBoostingRegressor(n_estimators=5)])
+def test_reconciled_forecasts_are_coherent(model, hierarchy):
+    (X, loads) = hierarchy
+    engine = Hierarchy(model).fit(X[:500], loads[:500])
+    assert len(engine.models_) == (len(series) if isinstance(model, GradientBoostingRegressor) else 1)
+    assert _incoherence(engine.predict(X[500:])) < 1e-6
+
+def test_reconcile_is_a_projection(hierarchy):
+    (_, loads) = hierarchy
+    # each series off by its own factor
+    forecasts = loads.to_numpy()[:5] * np.linspace(0.9, 1.1, len(series))
+    variances = np.arange(1.0, len(series) + 1)
+    once = reconcile(forecasts, variances)
+    np.testing.assert_allclose(reconcile(once, variances), once)
+    coherent = once.copy()
+    # a series with no error variance is left alone
+    variances[0] = 1e-12
+    np.testing.assert_allclose(reconcile(forecasts, variances)[:, 0], forecasts[:, 0], rtol=1e-9)
+    np.testing.assert_allclose(reconcile(coherent), coherent)
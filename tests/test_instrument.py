@@ -0,0 +1,47 @@
+from joblib import Parallel
+import fetch
+import instrument
+import pytest
+
+@pytest.fixture
+def enabled():
+    instrument.reset()
+    instrument.enable()
+    yield
+    instrument.disable()
+    instrument.reset()
+
+def _work(i):
+    with instrument.span('work', i=i):
+        instrument.count('items')
+    return 2 * i
+
+def test_disabled_records_nothing():
+    instrument.reset()
+    with instrument.span('work'):
+        instrument.count('items')
+    assert instrument.report() == {'spans': {}, 'counters': {}}
+
+def test_pool_records_are_gathered(enabled):
+    results = instrument.gather(Parallel(n_jobs=2)(instrument.delayed(_work)(i) for i in range(4)))
+    assert results == [0, 2, 4, 6]
+    report = instrument.report()
+    assert report['counters']['items'] == 4
+    assert report['spans']['work']['count'] == 4
+
+@pytest.mark.parametrize('on', [False, True])
+def test_download_all_span(http_server, tmp_path, on):
+    http_server.routes['/a.csv'] = [(200, b'a,b\n1,2\n')]
+    instrument.reset()
+    if on:
+        instrument.enable()
+    try:
+        fetch.download_all([(f'{http_server.url}/a.csv', f'{tmp_path}/a.csv')])
+        report = instrument.report()
+    finally:
+        instrument.disable()
+        instrument.reset()
+    assert (tmp_path / 'a.csv').read_bytes() == b'a,b\n1,2\n'
+    if on:
+        assert report['spans']['http.download']['count'] == 1
+        assert report['counters']['bytes_fetched'] == 8
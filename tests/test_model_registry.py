@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from model_registry import ModelRegistry
+from models import IncrementalOLS
+
+features = ['MSP', 'DSM']
+
+@pytest.fixture
+def zone(zone_frame):
+    df = zone_frame(days=20, stations=features)
+    return (df[features], df['LRZ1 ActualLoad (MWh)'])
+
+def test_warm_start_matches_full_fit(tmp_path, zone):
+    (X, y) = zone
+    registry = ModelRegistry(str(tmp_path))
+    (first, second) = (X.index[24*10 - 1], X.index[24*15 - 1])
+    registry.fit(IncrementalOLS(), 'LRZ1', features, first, X, y)
+    warm = registry.fit(IncrementalOLS(), 'LRZ1', features, second, X, y)
+    full = IncrementalOLS().fit(X[:second], y[:second])
+    assert warm.n_samples_ == full.n_samples_
+    np.testing.assert_allclose(warm.coef_, full.coef_)
+
+def test_reloaded_model_takes_partial_fit(tmp_path, zone):
+    (X, y) = zone
+    cutoff = X.index[24*10 - 1]
+    ModelRegistry(str(tmp_path)).fit(IncrementalOLS(), 'LRZ1', features, cutoff, X, y)
+    reloaded = ModelRegistry(str(tmp_path)).fit(IncrementalOLS(), 'LRZ1', features, cutoff, X, y)
+    reloaded.partial_fit(X[cutoff:][1:25], y[cutoff:][1:25])
+    assert reloaded.n_samples_ == 24*11
+    # the saved artifact is untouched
+    saved = ModelRegistry(str(tmp_path)).get('LRZ1', features, cutoff, IncrementalOLS())
+    assert saved.model.n_samples_ == 24*10
+
+def test_other_hyperparameters_miss(tmp_path, zone):
+    from sklearn.neighbors import KNeighborsRegressor
+    (X, y) = zone
+    registry = ModelRegistry(str(tmp_path))
+    registry.fit(KNeighborsRegressor(5), 'LRZ1', features, X.index[-1], X, y)
+    assert registry.get('LRZ1', features, X.index[-1], KNeighborsRegressor(5)) is not None
+    assert registry.get('LRZ1', features, X.index[-1], KNeighborsRegressor(6)) is None
+
+def test_service_updates_a_registry_model(tmp_path, zone):
+    from types import SimpleNamespace
+    from forecast_service import ForecastService
+    (X, y) = zone
+    cutoff = X.index[24*10 - 1]
+    data = X.assign(load=y)
+    ModelRegistry(str(tmp_path)).fit(IncrementalOLS(), 'LRZ1', features, cutoff, X, y)
+    model = ModelRegistry(str(tmp_path)).fit(IncrementalOLS(), 'LRZ1', features, cutoff, X, y)
+    service = ForecastService(SimpleNamespace(data=data[:cutoff], actual='load'), model, features, fitted=True)
+    service.update(data[cutoff:][1:25])
+    assert service.model.n_samples_ == 24*11
+    assert service.last_hour == X.index[24*11 - 1]
+
+def test_keras_model_saves_and_reloads(tmp_path, zone):
+    keras = pytest.importorskip('tensorflow').keras
+    def build():
+        model = keras.Sequential([keras.Input((len(features),)), keras.layers.Dense(4, activation='relu'),
+                                  keras.layers.Dense(1)])
+        model.compile(optimizer='adam', loss='mse')
+        return model
+    (X, y) = zone
+    # the layers of a second build are named dense_2, dense_3, ...
+    assert ModelRegistry.config(build()) == ModelRegistry.config(build())
+    registry = ModelRegistry(str(tmp_path))
+    fitted = registry.fit(build(), 'LRZ1', features, X.index[-1], X, y)
+    assert isinstance(fitted, keras.Model)
+    saved = ModelRegistry(str(tmp_path)).get('LRZ1', features, X.index[-1], build())
+    assert saved is not None and saved.meta['format'] == 'keras'
+    np.testing.assert_allclose(saved.model.predict(X[:24].to_numpy(), verbose=0),
+                               fitted.predict(X[:24].to_numpy(), verbose=0), rtol=1e-6)
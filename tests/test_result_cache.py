@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+from validation import ResultCache, walkforward
+
+describe = ResultCache._ResultCache__describe
+
+num_hours_prior = 24
+
+def _make(shift):
+    def next_hour(actual, previous_hour, predicted_load):
+        return actual + shift
+    return next_hour
+
+def _reads_global(actual, previous_hour, predicted_load):
+    return actual + num_hours_prior
+
+def test_closures_are_keyed_on_their_cells():
+    assert describe(_make(1)) == describe(_make(1))
+    assert describe(_make(1)) != describe(_make(2))
+
+def test_globals_are_keyed_on_their_values(monkeypatch):
+    before = describe(_reads_global)
+    monkeypatch.setattr(__import__(__name__), 'num_hours_prior', 48)
+    assert describe(_reads_global) != before
+
+def test_cache_key_overrides():
+    f = _make(object())
+    f.cache_key = 'v1'
+    assert describe(f) == ('cache_key', 'v1')
+
+def _next_hour(actual, previous_hour, predicted_load):
+    return actual
+
+def test_cached_walkforward_matches(tmp_path, zone_frame):
+    df = zone_frame(days=12, stations=('MSP', 'DSM'))
+    (X, y) = (df[['MSP', 'DSM']], df['LRZ1 ActualLoad (MWh)'])
+    (start, end) = (X.index[24*8], X.index[-1])
+    cache = ResultCache(str(tmp_path))
+    (fresh, _) = walkforward(LinearRegression(), X, y, start, end, _next_hour, ['MSP', 'DSM'], cache=cache)
+    (cached, errors) = walkforward(LinearRegression(), X, y, start, end, _next_hour, ['MSP', 'DSM'], cache=cache)
+    assert len(cached) == 4
+    np.testing.assert_allclose(np.concatenate(cached), np.concatenate(fresh))
@@ -0,0 +1,46 @@
+import numpy as np
+import pyarrow as pa
+import pytest
+from datasets import DataSet, Scaler
+
+mtlf = 'LRZ1 MTLF (MWh)'
+actual = 'LRZ1 ActualLoad (MWh)'
+
+@pytest.fixture
+def dataset(tmp_path, zone_frame):
+    zone_frame(days=3*365).to_parquet(tmp_path / 'zone.parquet')
+    return DataSet(str(tmp_path / 'zone.parquet'), mtlf, actual)
+
+def test_streaming_statistics_match_pandas(zone_frame):
+    df = zone_frame(days=42)[['MSP', 'HourEnding']]
+    batches = pa.Table.from_pandas(df).to_batches(max_chunksize=77)
+    scaler = Scaler.fit(batches, ['MSP', 'HourEnding'])
+    np.testing.assert_allclose(scaler.mean, df.mean().to_numpy())
+    np.testing.assert_allclose(scaler.std, df.std().to_numpy())
+    assert scaler.count == 42*24
+
+def test_train_only_and_saved(dataset):
+    train = dataset.train_data[dataset.columns]
+    np.testing.assert_allclose(dataset.scaler.mean, train.mean().to_numpy())
+    np.testing.assert_allclose(dataset.scaler.std, train.std().to_numpy())
+    again = DataSet(dataset.path.replace('.arrow', '.parquet'), mtlf, actual)
+    # read back rather than recomputed
+    again.table = None
+    np.testing.assert_array_equal(again.scaler.mean, dataset.scaler.mean)
+
+def test_other_columns_are_not_read_back(dataset):
+    dataset.scaler
+    other = DataSet(dataset.path.replace('.arrow', '.parquet'), mtlf, actual, features=['MSP'])
+    assert other.scaler.columns == ['MSP', mtlf, actual]
+
+def test_apply_and_invert_in_place(dataset):
+    values = dataset.test_data[dataset.columns].to_numpy(dtype=np.float32)
+    original = values.copy()
+    address = values.__array_interface__['data'][0]
+    assert dataset.scaler.apply(values) is values
+    assert values.__array_interface__['data'][0] == address
+    dataset.scaler.invert(values)
+    np.testing.assert_allclose(values, original, rtol=1e-5)
+    target = original[:, -1].copy()
+    dataset.scaler.apply(target, [actual])
+    np.testing.assert_allclose(target, (original[:, -1] - dataset.scaler.mean[-1]) / dataset.scaler.std[-1], atol=1e-4)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from spatial import StationIndex, zone_centers
+
+def _grid():
+    """A 4 x 4 grid of stations half a degree apart, over Iowa"""
+    latlon = [(41.0 + 0.5 * i, -94.0 + 0.5 * j) for i in range(4) for j in range(4)]
+    return StationIndex(pd.DataFrame({'sid': [f'S{i:02d}' for i in range(len(latlon))], 'latlon': latlon}))
+
+@pytest.fixture
+def temps(zone_frame):
+    return zone_frame(days=1, stations=_grid().ids)[_grid().ids]
+
+def test_zone_weights_rows_sum_to_one():
+    index = _grid()
+    centers = {'West': [(41.5, -93.5, 2.0), (42.0, -93.0, 1.0)], 'East': [(42.5, -92.5, 1.0)]}
+    weights = index.zone_weights(centers, radius_miles=200)
+    assert weights.shape == (2, len(index.ids))
+    np.testing.assert_allclose(np.asarray(weights.sum(axis=1)).ravel(), 1.0)
+    assert index.zone_weights().shape == (len(zone_centers), len(index.ids))
+    # a zone with no station in range has no weights
+    far = index.zone_weights({'Gulf': [(30.0, -90.0, 1.0)]}, radius_miles=100)
+    assert far.nnz == 0
+
+def test_aggregate_is_the_weighted_average(temps):
+    index = _grid()
+    weights = index.weights([(41.7, -93.2), (42.1, -92.9)], k=4)
+    aggregated = index.aggregate(temps, weights, ['a', 'b'])
+    np.testing.assert_allclose(aggregated.to_numpy(), temps.to_numpy() @ weights.toarray().T)
+    # columns in another order are matched by station id
+    shuffled = temps[list(reversed(index.ids))]
+    np.testing.assert_allclose(index.aggregate(shuffled, weights, ['a', 'b']).to_numpy(), aggregated.to_numpy())
+
+def test_aggregate_renormalizes_over_reporting_stations(temps):
+    index = _grid()
+    weights = index.weights([(41.7, -93.2)], k=4)
+    (row, columns) = (weights.toarray()[0], weights.indices)
+    temps.iloc[3, columns[0]] = np.nan
+    temps.iloc[5, columns] = np.nan
+    aggregated = index.aggregate(temps, weights, ['a'])['a']
+    others = columns[1:]
+    expected = temps.iloc[3, others].to_numpy() @ row[others] / row[others].sum()
+    assert np.isclose(aggregated.iloc[3], expected)
+    assert np.isnan(aggregated.iloc[5])
+    assert aggregated.drop(aggregated.index[[3, 5]]).notna().all()
+
+def test_fill_gaps_uses_neighbours_only(temps):
+    index = _grid()
+    station = index.ids[5]
+    temps.loc[temps.index[2], station] = np.nan
+    (filled, interpolated) = index.fill_gaps(temps, k=3, radius_miles=60)
+    assert interpolated.to_numpy().sum() == 1 and interpolated.loc[temps.index[2], station]
+
+    (miles, positions) = index.nearest(index.latlon[5], 4)
+    (miles, positions) = (miles[0][positions[0] != 5][:3], positions[0][positions[0] != 5][:3])
+    w = 1.0 / miles**2
+    expected = temps.iloc[2, positions].to_numpy() @ w / w.sum()
+    assert np.isclose(filled.loc[temps.index[2], station], expected)
+    np.testing.assert_array_equal(filled.drop(columns=station).to_numpy(), temps.drop(columns=station).to_numpy())
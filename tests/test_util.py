@@ -0,0 +1,84 @@
+import json
+import os
+import time
+from datetime import timedelta
+import pytest
+from requests import Session
+from util import DiskCache, atomic_write, prune_lru
+
+def _entry(cache, url):
+    return cache._DiskCache__lookup(url)
+
+def test_hit_maps_the_body_and_closes_it(http_server, tmp_path):
+    http_server.routes['/a.json'] = [(200, b'{"a": [1, 2]}')]
+    cache = DiskCache(str(tmp_path))
+    url = f'{http_server.url}/a.json'
+    assert cache.get(Session(), url).json() == {'a': [1, 2]}
+    with cache.get(Session(), url) as response:
+        body = response.body
+        assert body.read() == b'{"a": [1, 2]}'
+        assert response.content == b'{"a": [1, 2]}'
+    assert body.closed
+    assert http_server.requests == ['/a.json']
+
+def test_empty_body(http_server, tmp_path):
+    http_server.routes['/empty'] = [(200, b'')]
+    cache = DiskCache(str(tmp_path))
+    with cache.get(Session(), f'{http_server.url}/empty') as response:
+        assert response.body.read() == b''
+
+def test_pruned_between_lookup_and_hit_is_a_miss(http_server, tmp_path, monkeypatch):
+    http_server.routes['/a'] = [(200, b'first'), (200, b'second')]
+    cache = DiskCache(str(tmp_path))
+    url = f'{http_server.url}/a'
+    cache.get(Session(), url).close()
+    entry = _entry(cache, url)
+    # the lookup saw the body, then prune removed it
+    monkeypatch.setattr(DiskCache, '_DiskCache__lookup', lambda self, u: dict(entry))
+    for body in (tmp_path / 'bodies').iterdir():
+        body.unlink()
+    with cache.get(Session(), url) as response:
+        assert response.content == b'second'
+
+def test_revalidated_but_pruned_is_fetched_again(http_server, tmp_path, monkeypatch):
+    http_server.routes['/a'] = [(200, b'first'), (304, b''), (200, b'again')]
+    cache = DiskCache(str(tmp_path), fresh_for=timedelta(0))
+    url = f'{http_server.url}/a'
+    cache.get(Session(), url).close()
+    entry = _entry(cache, url)
+    entry['etag'] = '"x"'
+    monkeypatch.setattr(DiskCache, '_DiskCache__lookup', lambda self, u: dict(entry))
+    for body in (tmp_path / 'bodies').iterdir():
+        body.unlink()
+    with cache.get(Session(), url) as response:
+        assert response.content == b'again'
+    assert http_server.requests == ['/a'] * 3
+
+def test_prune_keeps_open_bodies_readable(http_server, tmp_path):
+    http_server.routes['/a'] = [(200, b'x' * 4096)]
+    cache = DiskCache(str(tmp_path), max_bytes=0)
+    with cache.get(Session(), f'{http_server.url}/a') as response:
+        body = response.body
+        cache.prune()
+        assert body.read() == b'x' * 4096
+
+def test_atomic_write_leaves_nothing_behind_on_failure(tmp_path):
+    path = tmp_path / 'a.bin'
+    atomic_write(str(path), b'old')
+    def fail(staging):
+        open(staging, 'wb').write(b'partial')
+        raise OSError('disk full')
+    with pytest.raises(OSError):
+        atomic_write(str(path), fail)
+    assert path.read_bytes() == b'old'
+    assert [p.name for p in tmp_path.iterdir()] == ['a.bin']
+
+def test_prune_lru_drops_old_then_least_recently_used(tmp_path):
+    (tmp_path / 'ab').mkdir()
+    now = time.time()
+    for (name, age) in [('old', 100), ('ab/lru', 3), ('ab/mru', 1), ('_1_staging', 5)]:
+        (tmp_path / name).write_bytes(b'x' * 10)
+        os.utime(tmp_path / name, (now - age * 86400,) * 2)
+    prune_lru(str(tmp_path), 10, timedelta(days=30))
+    remaining = sorted(str(p.relative_to(tmp_path)) for p in tmp_path.rglob('*') if p.is_file())
+    assert remaining == ['_1_staging', 'ab/mru']
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.neighbors import KNeighborsRegressor
+from datasets import Zone1, prior_load_colname
+from validation import recursive_prediction, walkforward
+
+actual = 'LRZ1 ActualLoad (MWh)'
+features = [prior_load_colname(i) for i in Zone1.correlated_prior_hours] + ['DayOfYear', 'IsBusinessHour', 'HourEnding']
+
+# the per-row recursion, as it was before the lockstep one
+def _old_next_hour(actual, previous_hour, predicted_load):
+    next = actual.copy()
+    next[prior_load_colname(1)] = predicted_load
+    for i in Zone1.correlated_prior_hours[1:]:
+        next[prior_load_colname(i)] = previous_hour[prior_load_colname(i-1)].iloc[0]
+    return next
+
+def _old_hourly_prediction(fitted_model, Xpredict, next_hour, active_features):
+    yhats = []
+    x = Xpredict.iloc[0:1]
+    yhats.append(fitted_model.predict(x[active_features])[0])
+    for i in range(1, Xpredict.shape[0]):
+        yhat = yhats[i - 1]
+        x = next_hour(Xpredict.iloc[i:i+1], x, yhat)
+        yhats.append(fitted_model.predict(x[active_features])[0])
+    return yhats
+
+@pytest.fixture
+def zone(zone_frame):
+    df = zone_frame(days=60)
+    X = df[['MSP', 'HourEnding']].copy()
+    for i in range(1, Zone1.num_hours_prior + 1):
+        X[prior_load_colname(i)] = df[actual].shift(i)
+    X['DayOfYear'] = df.index.day_of_year
+    X['IsBusinessHour'] = ((df.index.hour >= 8) & (df.index.hour < 18)).astype(int)
+    return (X[Zone1.num_hours_prior:], df[actual][Zone1.num_hours_prior:])
+
+# a linear model's batched dot products may round differently from one-row ones
+models = [(KNeighborsRegressor(5), True), (GradientBoostingRegressor(n_estimators=20, random_state=0), True),
+          (LinearRegression(), False)]
+
+def _compare(new, old, exact):
+    if exact:
+        np.testing.assert_array_equal(new, old)
+    else:
+        np.testing.assert_allclose(new, old, rtol=1e-9)
+
+@pytest.mark.parametrize(('model', 'exact'), models)
+def test_lockstep_matches_hourly_prediction(zone, model, exact):
+    (X, y) = zone
+    days = 30
+    (history, Xpredict) = (X[:-24*days], X[-24*days:])
+    fitted = model.fit(history[features], y[:-24*days])
+    old = np.concatenate([_old_hourly_prediction(fitted, Xpredict.iloc[24*d:24*(d+1)], _old_next_hour, features)
+                          for d in range(days)])
+    _compare(recursive_prediction(fitted, Xpredict, Zone1.next_hour, features), old, exact)
+
+@pytest.mark.parametrize(('model', 'exact'), models)
+def test_refit_blocks_match_hourly_prediction(zone, model, exact):
+    (X, y) = zone
+    (start, end) = (X.index[-24*10], X.index[-1])
+    (predictions, _) = walkforward(model, X, y, start, end, Zone1.next_hour, features, refit_every=10)
+    fitted = model.fit(X[:start][features], y[:start])
+    Xpredict = X[start:end]
+    old = [_old_hourly_prediction(fitted, Xpredict.iloc[24*d:24*(d+1)], _old_next_hour, features)
+           for d in range(10)]
+    _compare(np.concatenate(predictions), np.concatenate(old), exact)
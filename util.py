@@ -1,26 +1,228 @@
-import weakref
+import hashlib
+import io
+import json
+import mmap
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 from requests import Session
 from requests.sessions import HTTPAdapter
 from urllib3.util.retry import Retry
-from functools import cached_property, cache
+from functools import cached_property
+import instrument
 
-@cache
-def get_cached(url:str, s):
-    print(f'Fetching {url}')
-    return s().get(url)
+retries = Retry(total=5, backoff_factor=0.1,
+                status_forcelist=[500, 502, 503, 504])
+
+def atomic_write(path, data):
+    """Replaces the file at path with data, bytes or a function writing the
+    path it is given (e.g. df.to_parquet), in one step, so readers in other
+    processes never see a partial file. The staging file's name starts with
+    '_', which pyarrow datasets and prune_lru pass over."""
+    staging = f'{Path(path).parent}/_{os.getpid()}_{Path(path).name}'
+    try:
+        if callable(data):
+            data(staging)
+        else:
+            with open(staging, 'wb') as f:
+                f.write(data)
+        os.replace(staging, path)
+    except BaseException:
+        Path(staging).unlink(missing_ok=True)
+        raise
+
+def _remove(path):
+    # a file mapped by another process cannot be removed on Windows; it goes next time
+    try:
+        Path(path).unlink(missing_ok=True)
+    except PermissionError:
+        pass
+
+def prune_lru(folder, max_bytes, max_age):
+    """Removes the files under folder (and its subfolders) unused for max_age,
+    then the least recently used ones until the rest total at most max_bytes
+    (no limit when None). A file is used when it is written or os.utime
+    touches it. Staging files of atomic_write only go with age."""
+    oldest = datetime.now(timezone.utc).timestamp() - max_age.total_seconds()
+    files = []
+    for (parent, _, names) in os.walk(folder):
+        for name in names:
+            path = os.path.join(parent, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # removed by another process meanwhile
+                continue
+            if stat.st_mtime < oldest:
+                _remove(path)
+            elif not name.startswith('_'):
+                files.append((stat.st_mtime, stat.st_size, path))
+    if max_bytes is None:
+        return
+    total = sum(size for (_, size, _) in files)
+    for (_, size, path) in sorted(files):
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+
+class CachedResponse():
+    """The parts of a requests.Response the clients use, over a cached body"""
+    def __init__(self, url, path) -> None:
+        self.url = url
+        self.status_code = 200
+        self.reason = 'OK'
+        self.ok = True
+        self.__path = path
+
+    @cached_property
+    def body(self):
+        """The body memory-mapped read-only, without copying it into memory;
+        closed by close (or leaving a with block on the response or the body)"""
+        if os.path.getsize(self.__path) == 0:
+            return io.BytesIO()
+        with open(self.__path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def content(self):
+        """A copy of the body; read body instead to keep memory bounded"""
+        with open(self.__path, 'rb') as f:
+            return f.read()
+
+    def json(self):
+        with open(self.__path, 'rb') as f:
+            return json.load(f)
+
+    def close(self):
+        if 'body' in self.__dict__:
+            self.body.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class DiskCache():
+    """Content-addressed HTTP cache shared by every process using the folder.
+
+    Bodies are stored once under their sha256; each URL has a small JSON entry
+    with the body digest and its validators. Entries younger than fresh_for
+    are served without any request, older ones are revalidated with
+    If-None-Match/If-Modified-Since. Bodies unused for max_age are dropped,
+    and the least recently used go first when the folder exceeds max_bytes.
+    """
+    def __init__(self, folder, max_bytes=4 << 30, max_age=timedelta(days=90),
+                 fresh_for=timedelta(days=1)) -> None:
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fresh_for = fresh_for
+        self.__written = 0
+        Path(f'{folder}/bodies').mkdir(parents=True, exist_ok=True)
+        Path(f'{folder}/urls').mkdir(exist_ok=True)
+
+    @staticmethod
+    def __digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def __entry_path(self, url):
+        return f'{self.folder}/urls/{DiskCache.__digest(url.encode())}.json'
+
+    def __body_path(self, digest):
+        return f'{self.folder}/bodies/{digest}'
+
+    def __lookup(self, url):
+        try:
+            with open(self.__entry_path(url)) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return entry if os.path.isfile(self.__body_path(entry['digest'])) else None
+
+    def __hit(self, url, entry):
+        """The cached response, or None if prune removed the body meanwhile"""
+        path = self.__body_path(entry['digest'])
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return CachedResponse(url, path)
+
+    def __store(self, url, response):
+        # pruned before storing, so the body about to be returned is never the one removed
+        if self.__written > self.max_bytes // 16:
+            self.prune()
+        digest = DiskCache.__digest(response.content)
+        path = self.__body_path(digest)
+        if not os.path.isfile(path):
+            atomic_write(path, response.content)
+            self.__written += len(response.content)
+        entry = {'digest': digest,
+                 'etag': response.headers.get('ETag'),
+                 'last_modified': response.headers.get('Last-Modified'),
+                 'fetched': datetime.now(timezone.utc).timestamp()}
+        atomic_write(self.__entry_path(url), json.dumps(entry).encode())
+        return CachedResponse(url, path)
+
+    def get(self, session, url):
+        entry = self.__lookup(url)
+        now = datetime.now(timezone.utc).timestamp()
+        if entry and now - entry['fetched'] < self.fresh_for.total_seconds():
+            hit = self.__hit(url, entry)
+            if hit is not None:
+                instrument.count('http_cache.hits')
+                return hit
+            entry = None
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        print(f'Fetching {url}')
+        with instrument.span('http.get', url=url):
+            response = session.get(url, headers=headers)
+        instrument.count('bytes_fetched', len(response.content))
+        if entry and response.status_code == 304:
+            instrument.count('http_cache.revalidated')
+            entry['fetched'] = now
+            atomic_write(self.__entry_path(url), json.dumps(entry).encode())
+            hit = self.__hit(url, entry)
+            if hit is not None:
+                return hit
+            # the body was pruned after the lookup, so fetch it again in full
+            response = session.get(url)
+        if not response.ok:
+            return response
+        return self.__store(url, response)
+
+    def prune(self):
+        """Applies the age and size limits"""
+        self.__written = 0
+        prune_lru(f'{self.folder}/bodies', self.max_bytes, self.max_age)
+        # entries whose body is gone are misses anyway; drop the stale ones
+        prune_lru(f'{self.folder}/urls', None, self.max_age)
 
 class WebClient():
-    __retries = Retry(total=5, backoff_factor=0.1,
-                    status_forcelist=[500, 502, 503, 504])
+    http_cache = './data/http_cache'
 
     @cached_property
     def session(self):
         s = Session()
-        s.mount('https://', HTTPAdapter(max_retries=WebClient.__retries))
+        s.mount('https://', HTTPAdapter(max_retries=retries))
         return s
 
+    @cached_property
+    def cache(self):
+        return DiskCache(self.http_cache)
+
     def get_cached(self, url):
-        return get_cached(url, weakref.ref(self.session))
+        return self.cache.get(self.session, url)
     
     def get(self, url):
-        return self.session.get(url)
\ No newline at end of file
+        with instrument.span('http.get', url=url):
+            response = self.session.get(url)
+        instrument.count('bytes_fetched', len(response.content))
+        return response
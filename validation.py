@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 from typing import List
 import numpy as np
+import pandas as pd
 from sklearn.metrics import mean_absolute_error, max_error
 
 def show_error(y, yhat):
@@ -19,59 +20,544 @@ class Error():
     yhat: InitVar[List] = None
 
     def __init__(self, y, yhat) -> None:
-        self.mae = mean_absolute_error(y, yhat)
-        self.max = max_error(y, yhat)
-        self.total = sum(abs(y - yhat))
+        residual = np.abs(np.asarray(y, dtype=np.float64) - np.asarray(yhat, dtype=np.float64))
+        self.mae = residual.mean()
+        self.max = residual.max()
+        self.total = residual.sum()
+
+class Metrics():
+    """Streaming error statistics. update with as many (y, yhat) batches as
+    needed, possibly in different workers, combine the accumulators with +,
+    then read the metrics off at the end. Alongside the overall MAE, max,
+    total, RMSE and MAPE it keeps them per hour ending and per weekday, and
+    the same for a benchmark forecast (e.g. the MTLF) when one is given.
+    """
+    # rows: overall, then 24 hours ending, then 7 weekdays
+    __rows = 1 + 24 + 7
+    # columns: count, sum |e|, sum e^2, max |e|, sum |e|/|y|, count of y != 0
+    __columns = 6
+
+    def __init__(self) -> None:
+        self.model = np.zeros((Metrics.__rows, Metrics.__columns))
+        self.benchmark = None
+
+    @staticmethod
+    def __accumulate(stats, y, yhat, groups):
+        residual = np.abs(y - yhat)
+        nonzero = y != 0
+        percent = np.divide(residual, np.abs(y), out=np.zeros_like(residual), where=nonzero)
+        cells = np.column_stack([np.ones_like(residual), residual, residual**2,
+                                 np.zeros_like(residual), percent, nonzero])
+        for column in [0, 1, 2, 4, 5]:
+            stats[:, column] += np.bincount(groups.reshape(-1), np.repeat(cells[:, column], 3),
+                                            minlength=stats.shape[0])
+        np.maximum.at(stats[:, 3], groups.reshape(-1), np.repeat(residual, 3))
+
+    def update(self, y, yhat, hours: pd.DatetimeIndex = None, benchmark=None):
+        """hours default to y's index"""
+        if hours is None:
+            hours = y.index
+        y = np.asarray(y, dtype=np.float64).reshape(-1)
+        groups = np.column_stack([np.zeros(len(y), dtype=int), 1 + hours.hour, 25 + hours.dayofweek])
+        Metrics.__accumulate(self.model, y, np.asarray(yhat, dtype=np.float64).reshape(-1), groups)
+        if benchmark is not None:
+            if self.benchmark is None:
+                self.benchmark = np.zeros_like(self.model)
+            Metrics.__accumulate(self.benchmark, y, np.asarray(benchmark, dtype=np.float64).reshape(-1), groups)
+        return self
+
+    @staticmethod
+    def __combine(a, b):
+        if a is None or b is None:
+            return a if b is None else b
+        combined = a + b
+        combined[:, 3] = np.maximum(a[:, 3], b[:, 3])
+        return combined
+
+    def __add__(self, other):
+        combined = Metrics()
+        combined.model = Metrics.__combine(self.model, other.model)
+        combined.benchmark = Metrics.__combine(self.benchmark, other.benchmark)
+        return combined
+
+    def __radd__(self, other):
+        # so sum() works
+        return self if other == 0 else self + other
+
+    @staticmethod
+    def __frame(stats, index):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.DataFrame({'mae': stats[:, 1] / stats[:, 0],
+                                 'max': stats[:, 3],
+                                 'total': stats[:, 1],
+                                 'rmse': np.sqrt(stats[:, 2] / stats[:, 0]),
+                                 'mape': 100 * stats[:, 4] / stats[:, 5]}, index=index)
+
+    def __breakdown(self, rows, index):
+        df = Metrics.__frame(self.model[rows], index)
+        if self.benchmark is not None:
+            df = df.join(Metrics.__frame(self.benchmark[rows], index).add_prefix('benchmark '))
+        return df
+
+    def summary(self):
+        return self.__breakdown(slice(0, 1), pd.Index(['all']))
+
+    def by_hour(self):
+        return self.__breakdown(slice(1, 25), pd.RangeIndex(1, 25, name='HourEnding'))
+
+    def by_weekday(self):
+        return self.__breakdown(slice(25, 32), pd.RangeIndex(0, 7, name='DayOfWeek'))
 
-import pandas as pd
+    @property
+    def mae(self):
+        return self.model[0, 1] / self.model[0, 0]
+
+    @property
+    def max(self):
+        return self.model[0, 3]
 
-from joblib import Parallel, delayed
+    @property
+    def total(self):
+        return self.model[0, 1]
+
+    @property
+    def rmse(self):
+        return np.sqrt(self.model[0, 2] / self.model[0, 0])
+
+    @property
+    def mape(self):
+        return 100 * self.model[0, 4] / self.model[0, 5]
+
+    @property
+    def skill(self):
+        """1 - MAE / benchmark MAE: the fraction of the benchmark's error avoided"""
+        return 1 - self.model[0, 1] / self.benchmark[0, 1]
+
+from datasets import LagRecursion
+
+from joblib import Parallel, hash as joblib_hash
 from multiprocessing import cpu_count
+from shutil import rmtree
+from tempfile import mkdtemp
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from types import ModuleType
+import instrument
+from model_registry import ModelRegistry
+from util import atomic_write, prune_lru
 parallel = Parallel(n_jobs=cpu_count())
 
-def walkforward(model, all_X, all_y, start_hour, end_hour, next_hour, active_features):
+class ResultCache():
+    """Per-day walkforward results (the day's predictions and Error) on disk,
+    shared by every run using the folder.
+
+    A day's key covers the estimator's class and params, the active features
+    and the rest of the walkforward configuration, plus a running digest of
+    every row up to and including the day, so a rerun (or an overlapping
+    sweep) skips the days already computed. The estimator is keyed as in
+    ModelRegistry.config. Results unused for
+    max_age are dropped, and the least recently used go first when the
+    folder exceeds max_bytes.
+    """
+    def __init__(self, folder='./data/walkforward_cache', max_bytes=256 << 20,
+                 max_age=timedelta(days=90)) -> None:
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.__written = 0
+        Path(folder).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def __describe(next_hour, seen=()):
+        """What a next_hour function computes with: its code and constants,
+        the values it closes over and the globals it reads, functions among
+        them described in turn. One with a cache_key attribute is keyed on
+        that alone, e.g. when it reads something that cannot be hashed."""
+        if hasattr(next_hour, 'cache_key'):
+            return ('cache_key', next_hour.cache_key)
+        code = getattr(next_hour, '__code__', None)
+        if code is None:
+            return next_hour
+        seen = seen + (id(next_hour),)
+
+        def value(v):
+            if isinstance(v, ModuleType):
+                return v.__name__
+            if hasattr(v, '__code__'):
+                return v.__qualname__ if id(v) in seen else ResultCache.__describe(v, seen)
+            return v
+
+        cells = []
+        for cell in next_hour.__closure__ or ():
+            try:
+                cells.append(value(cell.cell_contents))
+            except ValueError:
+                # a cell not assigned yet
+                cells.append(None)
+        names = getattr(next_hour, '__globals__', {})
+        referenced = {name: value(names[name]) for name in code.co_names if name in names}
+        try:
+            state = joblib_hash((cells, referenced))
+        except Exception as e:
+            raise ValueError(f'cannot key {next_hour.__qualname__} on the values it reads; '
+                             'give it a cache_key attribute') from e
+        constants = [c for c in code.co_consts if not hasattr(c, 'co_code')]
+        return (next_hour.__module__, next_hour.__qualname__, code.co_code, repr(constants), state)
+
+    def keys(self, model, walk, refit_every, incremental):
+        """The key of each day of the walk"""
+        config = joblib_hash((ModelRegistry.config(model), walk.active_features, walk.columns, walk.stride, walk.direct,
+                              refit_every, incremental, ResultCache.__describe(walk.next_hour)))
+        rows = hashlib.sha256(config.encode())
+        rows.update(np.ascontiguousarray(walk.features[:walk.history]).data)
+        rows.update(np.ascontiguousarray(walk.target[:walk.history]).data)
+        keys = []
+        for d in range(walk.days):
+            day = walk.rows(d, d + 1)
+            rows.update(np.ascontiguousarray(walk.features[day]).data)
+            rows.update(np.ascontiguousarray(walk.target[day]).data)
+            rows.update(walk.hours[walk.stride*d:walk.stride*(d + 1)].asi8.data)
+            # with refit_every > 1 the fit a day gets depends on its place in the block
+            keys.append(f'{rows.hexdigest()}_{d % refit_every}')
+        return keys
+
+    def __path(self, key):
+        return f'{self.folder}/{key[:2]}/{key}.pkl'
+
+    def get(self, key):
+        """(prediction, Error) or None"""
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            instrument.count('walkforward_cache.misses')
+            return None
+        instrument.count('walkforward_cache.hits')
+        os.utime(path)
+        return result
+
+    def put(self, key, prediction, error):
+        path = self.__path(key)
+        Path(path).parent.mkdir(exist_ok=True)
+        data = pickle.dumps((prediction, error))
+        atomic_write(path, data)
+        self.__written += len(data)
+        if self.__written > self.max_bytes // 16:
+            self.prune()
+
+    def prune(self):
+        """Applies the age and size limits"""
+        self.__written = 0
+        prune_lru(self.folder, self.max_bytes, self.max_age)
+
+def walkforward(model, all_X, all_y, start_hour, end_hour, next_hour, active_features,
+                refit_every=1, incremental=False, direct=False, cache=None,
+                aggregate=False, benchmark=None):
+    """Daily walk-forward validation over [start_hour, end_hour].
+
+    By default the model is refit on the full history before every day. With
+    refit_every=N one fit serves N consecutive days, which are then predicted
+    together. With incremental=True the model is fit once on the history and
+    brought forward a day at a time with partial_fit (see models.IncrementalOLS).
+
+    With direct=True, next_hour is not used: the model predicts all 24 hours
+    of a day at once from the features of the day's first hour (those known
+    at midnight), see direct_prediction. It is fit against (days, 24) targets,
+    so it must support multiple outputs natively (e.g. LinearRegression,
+    KNeighborsRegressor) or be wrapped in sklearn's MultiOutputRegressor for
+    one model per hour.
+
+    The history and validation rows are written once to memory-mapped files;
+    workers only receive the model and the day range they are to compute.
+
+    Given a ResultCache, days already computed with the same model, features
+    and data are read from it, and only the rest are computed (and stored).
+
+    With aggregate=True a Metrics over the whole walk is returned instead of
+    the predictions and errors; workers send back the statistics of their
+    days rather than the predictions. A benchmark aligned with all_y (e.g.
+    ds.data[ds.mtlf]) is scored alongside.
+    """
+    folder = mkdtemp(prefix='walkforward_')
+    try:
+        walk = _walk(folder, all_X, all_y, start_hour, end_hour, next_hour, active_features, direct,
+                     benchmark)
+        strides = walk.days
+        if incremental and not hasattr(model, 'partial_fit'):
+            raise ValueError(f'{type(model).__name__} does not support partial_fit')
+        keys = cache.keys(model, walk, refit_every, incremental) if cache else []
+        results = []
+        for (d, key) in enumerate(keys):
+            hit = cache.get(key)
+            if hit is not None:
+                results.append((d, *hit))
+        cached = {r[0] for r in results}
+        missing = [d for d in range(strides) if d not in cached]
+        missing_set = set(missing)
+
+        if missing and incremental:
+            # every day depends on the ones before it
+            computed = _incremental_steps(model, walk, missing[-1] + 1)
+        elif missing:
+            starts = [d for d in range(0, strides, refit_every)
+                      if any(m in missing_set for m in range(d, min(d + refit_every, strides)))]
+            streaming = aggregate and not cache
+            blocks = instrument.gather(parallel(
+                instrument.delayed(_refit_step)(model, walk, d, min(d + refit_every, strides), streaming)
+                for d in starts))
+            if streaming:
+                return sum(blocks, Metrics())
+            computed = [r for block in blocks for r in block]
+        else:
+            computed = []
+        computed = [r for r in computed if r[0] not in cached]
+        if cache:
+            for (d, prediction, error) in computed:
+                cache.put(keys[d], prediction, error)
+        results.extend(computed)
+        if aggregate:
+            return walk.metrics(results)
+    finally:
+        rmtree(folder, ignore_errors=True)
+    results = sorted(results, key=lambda r: r[0])
+    predictions = [r[1] for r in results]
+    errors = [r[2] for r in results]
+    
+    return (predictions, errors)
+
+def sweep(configs, all_X, all_y, start_hour, end_hour, next_hour, refit_every=1, direct=False,
+          cache=None, wave=28, dominated_z=None, min_days=28):
+    """walkforward for many configurations at once: configs maps a name to a
+    (model, active_features) pair. The fits of every configuration are
+    scheduled together on the shared worker pool, a wave of days at a time,
+    so the pool stays busy through the last days of each.
+
+    With dominated_z, a configuration is dropped after a wave once it has
+    min_days days scored and its daily MAE is worse than the best running
+    configuration's by more than dominated_z standard errors of the paired
+    difference.
+
+    Returns one row per configuration and day: config, day (its first hour),
+    mae, max and total.
+    """
+    folder = mkdtemp(prefix='sweep_')
+    try:
+        walks = {}
+        for (i, (name, (_, active_features))) in enumerate(configs.items()):
+            Path(f'{folder}/{i}').mkdir()
+            walks[name] = _walk(f'{folder}/{i}', all_X, all_y, start_hour, end_hour,
+                                next_hour, active_features, direct)
+        strides = next(iter(walks.values())).days
+        keys = {name: cache.keys(configs[name][0], walks[name], refit_every, False)
+                for name in configs} if cache else {}
+        errors = {name: {} for name in configs}
+        live = list(configs)
+
+        wave = max(refit_every, wave - wave % refit_every)
+        for first in range(0, strides, wave):
+            tasks = []
+            for name in live:
+                for start in range(first, min(first + wave, strides), refit_every):
+                    last = min(start + refit_every, strides)
+                    hits = [cache.get(keys[name][d]) for d in range(start, last)] if cache else [None]
+                    if all(hit is not None for hit in hits):
+                        for (d, (_, error)) in enumerate(hits, start):
+                            errors[name][d] = error
+                    else:
+                        tasks.append((name, start, last))
+
+            blocks = instrument.gather(parallel(
+                instrument.delayed(_refit_step)(configs[name][0], walks[name], start, last)
+                for (name, start, last) in tasks))
+            for ((name, _, _), block) in zip(tasks, blocks):
+                for (d, prediction, error) in block:
+                    errors[name][d] = error
+                    if cache:
+                        cache.put(keys[name][d], prediction, error)
+
+            if dominated_z is not None:
+                live = _undominated(errors, live, dominated_z, min_days)
+    finally:
+        rmtree(folder, ignore_errors=True)
+
+    rows = [(name, walks[name].hours[walks[name].stride*d], e.mae, e.max, e.total)
+            for name in configs for (d, e) in sorted(errors[name].items())]
+    return pd.DataFrame(rows, columns=['config', 'day', 'mae', 'max', 'total'])
+
+def _undominated(errors, live, z, min_days):
+    # every live configuration has been scored on the same days
+    mae = {name: np.array([e.mae for (_, e) in sorted(errors[name].items())]) for name in live}
+    best = min(live, key=lambda name: mae[name].mean())
+    keep = []
+    for name in live:
+        difference = mae[name] - mae[best]
+        n = len(difference)
+        if name != best and n >= max(min_days, 2) and \
+                difference.mean() > z * difference.std(ddof=1) / np.sqrt(n):
+            continue
+        keep.append(name)
+    return keep
+
+def _walk(folder, all_X, all_y, start_hour, end_hour, next_hour, active_features, direct=False,
+          benchmark=None):
+    """Writes the history and validation rows of a walk to folder"""
     stride = 24 # hours
     d = (end_hour - start_hour) + timedelta(hours=1) 
     total_hours = d.days * 24 + d.seconds // 3600
-    strides = total_hours / stride
-    assert strides - int(strides) == 0
-    strides = int(strides)
+    assert total_hours % stride == 0
 
     X = all_X[:start_hour]
     y = all_y[:start_hour]
+    if direct:
+        # a day's targets are the hours that follow its first hour, so the
+        # history must run up to the validation rows without overlapping them
+        X = all_X[all_X.index < start_hour]
+        y = all_y[all_y.index < start_hour]
 
     Xvalid = all_X[start_hour:end_hour]
     yvalid = all_y[start_hour:end_hour]
 
-    def step(d):
-        next_Xtrain = pd.concat([X, Xvalid.iloc[:stride*d]])
-        next_ytrain = pd.concat([y, yvalid.iloc[:stride*d]])
-
-        next_Xpredict = Xvalid.iloc[stride*d:stride*(d+1)]
-        next_y        = yvalid.iloc[stride*d:stride*(d+1)]
-
-        #print(f'Predicting {next_Xpredict.index.to_series().iloc[0]}')
-        #print(f'Predicting {next_Xpredict.index.to_series().iloc[-1]}')
+    if direct:
+        required = []
+    elif isinstance(next_hour, LagRecursion):
+        required = next_hour.columns
+    else:
+        required = all_X.select_dtypes('number').columns.to_list()
+    columns = list(dict.fromkeys(list(active_features) + required))
+
+    return _WalkForward(features=_shared_array(f'{folder}/features.npy', [X[columns], Xvalid[columns]]),
+                        target=_shared_array(f'{folder}/target.npy', [y, yvalid]),
+                        history=X.shape[0], hours=Xvalid.index, stride=stride,
+                        columns=columns, active_features=list(active_features),
+                        next_hour=next_hour, dtypes=X[columns].dtypes.to_dict(), direct=direct,
+                        benchmark=None if benchmark is None else
+                        _shared_array(f'{folder}/benchmark.npy', [benchmark[start_hour:end_hour]]))
+
+def _shared_array(path, frames):
+    rows = sum(f.shape[0] for f in frames)
+    # column-major, like the blocks pandas hands to the estimators
+    array = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                      shape=(rows,) + frames[0].shape[1:], fortran_order=True)
+    offset = 0
+    for f in frames:
+        array[offset:offset + f.shape[0]] = f.to_numpy(dtype=np.float64)
+        offset += f.shape[0]
+    array.flush()
+    del array
+    return np.load(path, mmap_mode='r')
 
-        fitted_model = model.fit(next_Xtrain[active_features], next_ytrain)
-        prediction = hourly_prediction(fitted_model, next_Xpredict, next_hour, active_features)
-        error = Error(y=next_y, yhat=prediction)
-        return d, prediction, error 
+@dataclass
+class _WalkForward():
+    """The memory-mapped history and validation rows (history first, so every
+    training set is a prefix) plus what is needed to predict a day range."""
+    features: np.ndarray
+    target: np.ndarray
+    history: int
+    hours: pd.DatetimeIndex
+    stride: int
+    columns: list
+    active_features: list
+    next_hour: object
+    dtypes: dict
+    direct: bool = False
+    benchmark: np.ndarray = None
 
-    results = parallel(delayed(step)(d) for d in range(0, strides))
-    #results = [step(d) for d in range(0, strides)]
-    results = sorted(results, key=lambda r: r[0])
-    predictions = [r[1] for r in results]
-    errors = [r[2] for r in results]
-    
-    return (predictions, errors)
+    @property
+    def days(self):
+        return len(self.hours) // self.stride
+
+    def rows(self, first, last):
+        return slice(self.history + self.stride*first, self.history + self.stride*last)
+
+    def train(self, rows):
+        X = pd.DataFrame(self.features[rows, :len(self.active_features)],
+                         columns=self.active_features, copy=False)
+        return X, pd.Series(self.target[rows], copy=False)
+
+    def train_direct(self, origins):
+        """The first hour of each day against all of the day's hours"""
+        X = pd.DataFrame(self.features[origins, :len(self.active_features)],
+                         columns=self.active_features)
+        return X, self.target[origins[:, None] + np.arange(self.stride)]
+
+    def before(self, day):
+        """Everything known before the day begins"""
+        end = self.rows(day, day).start
+        if self.direct:
+            return self.train_direct(np.arange(self.history % self.stride, end - self.stride + 1, self.stride))
+        return self.train(slice(0, end))
+
+    def during(self, day):
+        """What becomes known over the day"""
+        rows = self.rows(day, day + 1)
+        if self.direct:
+            return self.train_direct(np.array([rows.start]))
+        return self.train(rows)
+
+    def predict(self, fitted_model, first, last):
+        values = self.features[self.rows(first, last)]
+        if self.direct:
+            Xpredict = pd.DataFrame(values[:, :len(self.active_features)], columns=self.active_features)
+            yhat = direct_prediction(fitted_model, Xpredict, self.active_features, self.stride)
+            predictions = [yhat[self.stride*i:self.stride*(i+1)].tolist() for i in range(last - first)]
+        elif isinstance(self.next_hour, LagRecursion):
+            yhat = _lockstep_prediction(fitted_model, values, self.columns, self.next_hour,
+                                        self.active_features, self.stride)
+            predictions = [yhat[self.stride*i:self.stride*(i+1)].tolist() for i in range(last - first)]
+        else:
+            Xpredict = pd.DataFrame(values, columns=self.columns,
+                                    index=self.hours[self.stride*first:self.stride*last])
+            Xpredict = Xpredict.astype(self.dtypes)
+            predictions = [hourly_prediction(fitted_model, Xpredict.iloc[self.stride*i:self.stride*(i+1)],
+                                             self.next_hour, self.active_features)
+                           for i in range(last - first)]
+        results = []
+        for (d, prediction) in enumerate(predictions, first):
+            next_y = np.asarray(self.target[self.rows(d, d + 1)])
+            results.append((d, prediction, Error(y=next_y, yhat=prediction)))
+        return results
+
+    def metrics(self, results):
+        """Metrics over the days of (day, prediction, Error) results, in one pass"""
+        metrics = Metrics()
+        if not results:
+            return metrics
+        hours = np.concatenate([np.arange(self.stride*d, self.stride*(d + 1)) for (d, _, _) in results])
+        yhat = np.concatenate([prediction for (_, prediction, _) in results])
+        return metrics.update(self.target[self.history + hours], yhat, self.hours[hours],
+                              None if self.benchmark is None else self.benchmark[hours])
+
+def _refit_step(model, walk, first, last, aggregate=False):
+    with instrument.span('walkforward.fit', day=first):
+        fitted_model = model.fit(*walk.before(first))
+    with instrument.span('walkforward.predict', day=first, days=last - first):
+        results = walk.predict(fitted_model, first, last)
+    return walk.metrics(results) if aggregate else results
+
+def _incremental_steps(model, walk, strides):
+    results = []
+    with instrument.span('walkforward.fit', day=0):
+        fitted_model = model.fit(*walk.before(0))
+    for d in range(0, strides):
+        with instrument.span('walkforward.predict', day=d, days=1):
+            results.extend(walk.predict(fitted_model, d, d + 1))
+        with instrument.span('walkforward.partial_fit', day=d):
+            fitted_model = fitted_model.partial_fit(*walk.during(d))
+    return results
 
 # we cannot let the actuals leak into the validation set
 def hourly_prediction(fitted_model, Xpredict, next_hour, active_features):
+    if isinstance(next_hour, LagRecursion):
+        return recursive_prediction(fitted_model, Xpredict, next_hour, active_features,
+                                    stride=Xpredict.shape[0]).tolist()
     yhats = []
     # HACK: assume the first hour has the current hour STLF 
     # and short term weather forecast instead of actual
     # TODO: implement some noise to simulate these
+    instrument.count('predict_calls', Xpredict.shape[0])
     x = Xpredict.iloc[0:1]
     yhats.append(fitted_model.predict(x[active_features])[0])
     for i in range(1, Xpredict.shape[0]):
@@ -80,14 +566,61 @@ def hourly_prediction(fitted_model, Xpredict, next_hour, active_features):
         yhats.append(fitted_model.predict(x[active_features])[0])
     return yhats
 
+def recursive_prediction(fitted_model, Xpredict, recursion, active_features, stride=24):
+    """Same recursion as hourly_prediction with a LagRecursion, but every
+    `stride`-hour sequence of Xpredict runs in lockstep: the lag features live
+    in one preallocated (sequences, stride, columns) buffer and each hour of
+    the sequence is a single batched predict across all sequences. The
+    predictions are identical up to BLAS rounding: those of trees and
+    neighbours match exactly, while a linear model's batched products can
+    differ from its one-row ones in the last few bits."""
+    columns = list(dict.fromkeys(list(active_features) + recursion.columns))
+    return _lockstep_prediction(fitted_model, Xpredict[columns].to_numpy(dtype=np.float64),
+                                columns, recursion, active_features, stride)
+
+def direct_prediction(fitted_model, Xpredict, active_features, stride=24):
+    """All `stride` hours of every day of Xpredict from one predict, made
+    from the features of each day's first hour alone. Unlike hourly_prediction
+    nothing is fed back, so errors do not compound over the day."""
+    origins = Xpredict[active_features].iloc[::stride]
+    instrument.count('predict_calls')
+    return np.asarray(fitted_model.predict(origins)).reshape(-1)
+
+def _lockstep_prediction(fitted_model, values, columns, recursion, active_features, stride):
+    index = {name: i for i, name in enumerate(columns)}
+    active = [index[name] for name in active_features]
+    predicted = index[recursion.predicted]
+    targets = [index[column] for (column, _) in recursion.shifts]
+    priors = [index[prior] for (_, prior) in recursion.shifts]
+
+    sequences = values.shape[0] // stride
+    assert sequences * stride == values.shape[0]
+    buffer = np.array(values, dtype=np.float64, order='C').reshape(sequences, stride, len(columns))
+
+    yhats = np.empty((sequences, stride))
+    instrument.count('predict_calls', stride)
+    for h in range(stride):
+        if h > 0:
+            buffer[:, h, predicted] = yhats[:, h - 1]
+            buffer[:, h, targets] = buffer[:, h - 1, priors]
+        x = pd.DataFrame(buffer[:, h, active], columns=active_features)
+        yhats[:, h] = np.asarray(fitted_model.predict(x)).reshape(-1)
+    return yhats.reshape(-1)
+
 import numpy as np
 import tensorflow as tf
 import matplotlib.pyplot as plt
+from functools import cached_property
 
 class WindowGenerator():
     def __init__(self, input_width, label_width, shift,
                 train_df, val_df, test_df,
-                label_columns=None):
+                label_columns=None, batch_size=32, snapshot_dir=None):
+        """The train, val and test datasets are built on first use and kept.
+        Windows are gathered a batch at a time from one float32 copy of each
+        frame; train is reshuffled every epoch, val and test keep their order
+        and are cached after the first pass, in memory or, with snapshot_dir,
+        on disk there."""
         # Store the raw data.
         self.train_df = train_df
         self.val_df = val_df
@@ -100,6 +633,9 @@ class WindowGenerator():
                                         enumerate(label_columns)}
         self.column_indices = {name: i for i, name in
                                 enumerate(train_df.columns)}
+        self.label_gather = None if label_columns is None else [self.column_indices[name] for name in label_columns]
+        self.batch_size = batch_size
+        self.snapshot_dir = snapshot_dir
 
         # Work out the window parameters.
         self.input_width = input_width
@@ -126,9 +662,7 @@ class WindowGenerator():
         inputs = features[:, self.input_slice, :]
         labels = features[:, self.labels_slice, :]
         if self.label_columns is not None:
-            labels = tf.stack(
-                [labels[:, :, self.column_indices[name]] for name in self.label_columns],
-                axis=-1)
+            labels = tf.gather(labels, self.label_gather, axis=-1)
 
         # Slicing doesn't preserve static shape information, so set the shapes
         # manually. This way the `tf.data.Datasets` are easier to inspect.
@@ -136,18 +670,33 @@ class WindowGenerator():
         labels.set_shape([None, self.label_width, None])
         return inputs, labels
 
-    def make_dataset(self, data):
-        data = np.array(data, dtype=np.float32)
-        ds = tf.keras.utils.timeseries_dataset_from_array(
-            data=data,
-            targets=None,
-            sequence_length=self.total_window_size,
-            sequence_stride=1,
-            shuffle=True,
-            batch_size=32,)
-
-        ds = ds.map(self.split_window)
-        return ds
+    def make_dataset(self, data, shuffle=True, name=None):
+        """The same batches of (inputs, labels) windows as
+        timeseries_dataset_from_array with a stride of 1, but only the window
+        starts go through the pipeline; each batch is gathered from one
+        constant tensor of data"""
+        data = np.asarray(data, dtype=np.float32)
+        values = tf.constant(data)
+        offsets = tf.range(self.total_window_size, dtype=tf.int64)
+        num_windows = max(0, len(data) - self.total_window_size + 1)
+
+        ds = tf.data.Dataset.range(num_windows)
+        if shuffle:
+            ds = ds.shuffle(num_windows, reshuffle_each_iteration=True)
+        ds = ds.batch(self.batch_size)
+        ds = ds.map(lambda starts: self.split_window(tf.gather(values, starts[:, tf.newaxis] + offsets)),
+                    num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+        if not shuffle:
+            # a shuffled dataset is reordered every epoch, so only an ordered one is worth caching
+            if self.snapshot_dir is not None and name is not None:
+                # keyed by content, so a snapshot of other data or windows is never read back
+                key = joblib_hash((data, self.input_width, self.label_width, self.shift,
+                                   self.label_gather, self.batch_size))
+                Path(self.snapshot_dir).mkdir(parents=True, exist_ok=True)
+                ds = ds.cache(f'{self.snapshot_dir}/{name}_{key}')
+            else:
+                ds = ds.cache()
+        return ds.prefetch(tf.data.AUTOTUNE)
 
     def plot(self, model, plot_col = None, max_subplots=3):
         plot_col = self.label_columns[0] if plot_col is None else plot_col
@@ -183,17 +732,17 @@ class WindowGenerator():
         plt.xlabel('Time [h]')
 
 
-    @property
+    @cached_property
     def train(self):
-        return self.make_dataset(self.train_df)
+        return self.make_dataset(self.train_df, shuffle=True, name='train')
 
-    @property
+    @cached_property
     def val(self):
-        return self.make_dataset(self.val_df)
+        return self.make_dataset(self.val_df, shuffle=False, name='val')
 
-    @property
+    @cached_property
     def test(self):
-        return self.make_dataset(self.test_df)
+        return self.make_dataset(self.test_df, shuffle=False, name='test')
 
     @property
     def example(self):
@@ -1,10 +1,16 @@
 from datetime import datetime, timedelta
 from functools import cached_property
-from io import StringIO
+from genericpath import isfile
+from pathlib import Path
+import numpy as np
 import pandas as pd
 from pytz import utc
+import fetch
+import instrument
+import resample
 from util import WebClient
 from MISO import miso_states
+from spatial import StationIndex
 
 class ASOS(WebClient):
     """Pandas Adapter for the Iowa State ASOS Network downloads JSON API"""
@@ -16,30 +22,121 @@ class ASOS(WebClient):
         return pd.concat([self.__get_stations(state, self.first_year)
                             for state in miso_states])
 
-    def __get_station_csv(self, id: str, start: datetime, end: datetime):
+    @cached_property
+    def station_index(self):
+        """The spatial index of stations, for zone weights and gap filling"""
+        return StationIndex(self.stations)
+
+    @staticmethod
+    def __station_url(id: str, start: datetime, end: datetime):
         asos_url = 'https://mesonet.agron.iastate.edu/cgi-bin/request/asos.py'
         data_query = 'data=tmpf&data=feel'
         start = start.astimezone(tz=utc) 
         end = end.astimezone(tz=utc) + timedelta(days=1)
         date_query = f'year1={start.year}&month1={start.month}&day1={start.day}&year2={end.year}&month2={end.month}&day2={end.day}'
         query = f'?{data_query}&tz=Etc/UTC&format=comma&latlon=yes&{date_query}'
-        url = f'{asos_url}{query}&station={id}'
+        return f'{asos_url}{query}&station={id}'
+
+    def __get_station_csv(self, id: str, start: datetime, end: datetime):
+        """The cached response body, a read-only memory map of the CSV to be
+        used in a with block, which unmaps it"""
+        url = ASOS.__station_url(id, start, end)
         response = self.get_cached(url)
         if response.ok:
-            return response.content.decode('utf-8')
+            body = response.body
+            if len(body) > 0:
+                body.seek(0)
+            return body
         raise Exception(f'Request failed for {url}')
 
-    def get_hourly_observations(self, id: str, start: datetime, end: datetime) -> pd.DataFrame:
+    @staticmethod
+    def __utc_window(start: datetime, end: datetime):
         # we require extra data on ends for interpolation
         buffer = timedelta(days=7)
 
         # regardless of requested timezone, the API works in UTC
-        start_utc = start.astimezone(tz=utc) - buffer
-        end_utc = end.astimezone(tz=utc) + buffer
+        return (start.astimezone(tz=utc) - buffer, end.astimezone(tz=utc) + buffer)
+
+    def get_hourly_observations(self, id: str, start: datetime, end: datetime, output_dir: str = None) -> pd.DataFrame:
+        """Hourly temperatures for the station over [start, end]. Given an
+        output_dir, observations come from the station's store there (see
+        update_station) rather than a full download."""
+        (start_utc, end_utc) = ASOS.__utc_window(start, end)
+        if output_dir:
+            observations = self.update_station(id, start, end, output_dir)
+            observations = observations[start_utc - timedelta(days=1):end_utc + timedelta(days=1)]
+            with instrument.span('asos.hourly', station=id):
+                hourly = ASOS.__reindex(observations, start_utc, end_utc)
+        else:
+            with self.__get_station_csv(id, start_utc, end_utc) as csv, instrument.span('asos.hourly', station=id):
+                hourly = ASOS.__stream_hourly(csv, start_utc, end_utc)
+        return ASOS.__trim(ASOS.__fill([hourly])[0], id, start, end)
+
+    def __download_observations(self, id: str, start_utc: datetime, end_utc: datetime):
+        with self.__get_station_csv(id, start_utc, end_utc) as csv:
+            return ASOS.__observations(csv)
+
+    def update_station(self, id: str, start: datetime, end: datetime, output_dir: str) -> pd.DataFrame:
+        """Brings the station's stored observations ({output_dir}/{id}.parquet)
+        up to [start, end] plus the interpolation buffer, and returns them.
+        Only the days missing from the store are requested; the tail is
+        re-pulled from one buffer before the last stored observation, so late
+        or corrected reports are picked up."""
+        Path(output_dir).mkdir(exist_ok=True)
+        path = f'{output_dir}/{id}.parquet'
+        (start_utc, end_utc) = ASOS.__utc_window(start, end)
+        if not isfile(path):
+            observations = self.__download_observations(id, start_utc, end_utc)
+            observations.to_parquet(path)
+            return observations
+
+        stored = pd.read_parquet(path)
+        (first, last) = (stored.index[0], stored.index[-1])
+        parts = [stored]
+        if start_utc.date() < first.date():
+            head = self.__download_observations(id, start_utc, first)
+            parts.insert(0, head[:first - timedelta(microseconds=1)])
+        if end_utc > last:
+            # the API works in whole days, so keep what precedes the first day requested
+            tail_start = last - timedelta(days=7)
+            tail = self.__download_observations(id, tail_start, end_utc)
+            tail_day = pd.Timestamp(tail_start.date(), tz=utc)
+            parts[-1] = stored[:tail_day - timedelta(microseconds=1)]
+            parts.append(tail)
+        if len(parts) == 1:
+            return stored
+        observations = pd.concat(parts)
+        observations = observations[~observations.index.duplicated(keep='last')].sort_index()
+        observations.to_parquet(path)
+        return observations
+
+    def get_many_hourly_observations(self, ids, start: datetime, end: datetime, output_dir: str):
+        """get_hourly_observations for many stations, with the CSVs downloaded
+        concurrently into output_dir (and reused from there on later calls)"""
+        Path(output_dir).mkdir(exist_ok=True)
+        (start_utc, end_utc) = ASOS.__utc_window(start, end)
+        window = f'{start_utc:%Y%m%d}_{end_utc:%Y%m%d}'
+        paths = fetch.download_all((ASOS.__station_url(id, start_utc, end_utc), f'{output_dir}/{id}_{window}.csv')
+                                   for id in ids)
+        hourlies = []
+        for (id, path) in zip(ids, paths):
+            with open(path, 'rb') as f, instrument.span('asos.hourly', station=id):
+                hourlies.append(ASOS.__stream_hourly(f, start_utc, end_utc))
+        # all stations share the hourly grid, so their gaps are filled together
+        hourlies = ASOS.__fill(hourlies)
+        return {id: ASOS.__trim(hourly, id, start, end) for (id, hourly) in zip(ids, hourlies)}
 
-        # the CSV returned has a 5 line header
-        csv = self.__get_station_csv(id, start_utc, end_utc)
-        df = pd.read_csv(StringIO(csv), skiprows = 5)
+    @staticmethod
+    def __read_csv(csv, **kwargs):
+        # the CSV returned has a 5 line header, and missing observations have the value 'M'
+        return pd.read_csv(csv, skiprows = 5, usecols=['valid', 'tmpf'],
+                           dtype={'valid': str, 'tmpf': np.float64}, na_values=['M'], **kwargs)
+
+    @staticmethod
+    def __observations(csv) -> pd.DataFrame:
+        with instrument.span('asos.read_csv'):
+            df = ASOS.__read_csv(csv)
+        instrument.count('rows_parsed', df.shape[0])
         if df.size < 1:
             raise Exception(f'Error parsing {csv}')
 
@@ -47,53 +144,106 @@ class ASOS(WebClient):
         # but we want to preserve the original observation time
         df['idx'] = pd.to_datetime(df['valid'], utc=True)
         df['observation_time'] = df['idx']
-
-        # missing observations will have the value 'M', make that NaN
-        df['temp'] = pd.to_numeric(df['tmpf'], errors='coerce')
+        df['temp'] = df['tmpf']
 
         # we do not want to reuse NaN values when we reindex to hourly
         df = df.dropna()
         # some of the high sample rate sites have observations with duplicate timestamps
         df = df.drop_duplicates('idx')
+        return df.set_index('idx')[['observation_time', 'temp']]
+
+    @staticmethod
+    def __hourly_frame(utc_hours, observation_times, temps) -> pd.DataFrame:
+        # NaT is the smallest int64, so hours without an observation read back as missing
+        observation_time = pd.DatetimeIndex(observation_times.view('datetime64[ns]')).tz_localize(utc)
+        return pd.DataFrame({'observation_time': observation_time, 'temp': temps}, index=utc_hours)
 
-        # re-index to hourly 
-        df = df.set_index('idx')
-        utc_hours = pd.date_range(start_utc, end_utc, freq='H')
-        df = df.reindex(utc_hours, method='nearest', tolerance=timedelta(minutes=30))
+    @staticmethod
+    def __reindex(df: pd.DataFrame, start_utc: datetime, end_utc: datetime) -> pd.DataFrame:
+        # re-index to hourly, keeping the nearest observation within 30 minutes
+        utc_hours = pd.date_range(start_utc, end_utc, freq='h')
+        times = df.index.as_unit('ns').asi8
+        nearest = resample.nearest(times, utc_hours.as_unit('ns').asi8, pd.Timedelta(minutes=30).value)
+        found = nearest >= 0
+        return ASOS.__hourly_frame(utc_hours,
+                                   np.where(found, times[nearest], np.iinfo(np.int64).min),
+                                   np.where(found, df['temp'].to_numpy()[nearest], np.nan))
+
+    @staticmethod
+    def __stream_hourly(csv, start_utc: datetime, end_utc: datetime, chunksize=1 << 16) -> pd.DataFrame:
+        """__observations followed by __reindex, a chunk of the CSV at a time.
+
+        Every observation is only a candidate for the hours either side of
+        it, so each chunk is folded into per-hour arrays holding the nearest
+        observation within 30 minutes (the later one on a tie, the first one
+        of duplicate timestamps), which is the selection reindex makes.
+        Memory is proportional to the hours requested, not the observations.
+        """
+        utc_hours = pd.date_range(start_utc, end_utc, freq='h')
+        first = utc_hours.as_unit('ns').asi8[0]
+        hour = 3600 * 10**9
+        tolerance = hour // 2
+        best_distance = np.full(len(utc_hours), np.iinfo(np.int64).max)
+        best_time = np.full(len(utc_hours), np.iinfo(np.int64).min)
+        best_temp = np.full(len(utc_hours), np.nan)
 
-        # TODO: evaluate alternatives
-        df['temp'] = df['temp'].interpolate(method='spline', order=3)
+        rows = 0
+        for chunk in ASOS.__read_csv(csv, chunksize=chunksize):
+            rows += chunk.shape[0]
+            chunk = chunk.dropna()
+            times = pd.DatetimeIndex(pd.to_datetime(chunk['valid'], utc=True)).as_unit('ns').asi8
+            temps = chunk['tmpf'].to_numpy()
+            order = np.arange(times.shape[0])
+            below = (times - first) // hour
+            h = np.concatenate([below, below + 1])
+            t = np.concatenate([times, times])
+            distance = np.abs(t - (first + h * hour))
+            candidate = (distance <= tolerance) & (h >= 0) & (h < len(utc_hours))
+            (h, t, distance) = (h[candidate], t[candidate], distance[candidate])
+            v = np.concatenate([temps, temps])[candidate]
+            o = np.concatenate([order, order])[candidate]
 
+            # the best candidate of the chunk for each hour comes first
+            ranked = np.lexsort((o, -t, distance, h))
+            (hours, firsts) = np.unique(h[ranked], return_index=True)
+            winners = ranked[firsts]
+            better = ((distance[winners] < best_distance[hours])
+                      | ((distance[winners] == best_distance[hours]) & (t[winners] > best_time[hours])))
+            (hours, winners) = (hours[better], winners[better])
+            best_distance[hours] = distance[winners]
+            best_time[hours] = t[winners]
+            best_temp[hours] = v[winners]
+        instrument.count('rows_parsed', rows)
+        if rows < 1:
+            raise Exception(f'Error parsing {csv}')
+
+        return ASOS.__hourly_frame(utc_hours, best_time, best_temp)
+
+    @staticmethod
+    def __fill(hourlies):
+        """Interpolates the hours without an observation (PCHIP, see
+        resample.fill_gaps) and flags them in an 'interpolated' column"""
+        with instrument.span('asos.fill_gaps', stations=len(hourlies)):
+            (temps, interpolated) = resample.fill_gaps(np.column_stack([h['temp'].to_numpy() for h in hourlies]))
+        for (i, hourly) in enumerate(hourlies):
+            hourly['temp'] = temps[:, i]
+            hourly['interpolated'] = interpolated[:, i]
+        return hourlies
+
+    @staticmethod
+    def __trim(df: pd.DataFrame, id: str, start: datetime, end: datetime) -> pd.DataFrame:
         # having interpolated, we can trim back to original window
         df = df[start.astimezone(tz=utc):end.astimezone(tz=utc)]
 
         # switch the hourly index to the requested time zone
-        df['hour'] = pd.date_range(start, end, freq='H')
+        df['hour'] = pd.date_range(start, end, freq='h')
         df['station'] = id
-        return df[['station', 'observation_time', 'temp', 'hour']].set_index('hour')
+        return df[['station', 'observation_time', 'temp', 'interpolated', 'hour']].set_index('hour')
 
     def __get_stations(self, state, start_year):
-        """ DEFUNCT
-            This method could used with the following code to fillna observations
-            with the geographically nearest observations.
-
-            from geopy import distance
-            nearby = iter(self.get_nearest_stations(sid))
-            for nearby in self.get_nearest_stations(sid):
-                print(f'trying {nearby}')
-                other = self.get_station_data(nearby, start_date, end_date)
-                df = df.fillna(other)
-                if not any(pd.isna(df['tmpf'])):
-                    return df
-            return df
-            def get_nearest_stations(self, sid: str, radius_miles = 20):
-                stations = self.stations.copy()
-                target = stations[stations['sid'] == sid].iloc[0]['latlon']
-                stations['distance'] = stations['latlon'].apply(lambda c: distance.distance(target, c).mi)
-                stations = stations[stations['distance'] < radius_miles]
-                stations.sort_values(by=['distance'], inplace=True)
-                return stations[1:]['sid'].array
-        """
+        """The state's stations reporting since start_year. Filling a station's
+        missing hours from its geographically nearest neighbours is done for
+        all stations and hours at once by station_index.fill_gaps."""
         url = f'https://mesonet.agron.iastate.edu/geojson/network/{state}_ASOS.geojson'
         response = self.get_cached(url)
         if response.ok: